@@ -1,168 +1,286 @@
-from struct import pack
-from typing import Union
+from functools import lru_cache
+from struct import Struct, pack
+from typing import Any, Callable, Dict, List, Union
 
-from ..signature import Signature, Variant, parse_signature
+from ..signature import Signature, parse_signature
+
+UINT32_STRUCT = Struct("<I")
+
+# struct format characters for the fixed size types
+FIXED_FORMATS = {
+    "y": "B",
+    "b": "I",
+    "n": "h",
+    "q": "H",
+    "i": "i",
+    "u": "I",
+    "x": "q",
+    "t": "Q",
+    "d": "d",
+    "h": "I",
+}
+FIXED_SIZES = {type_code: Struct(fmt).size for type_code, fmt in FIXED_FORMATS.items()}
+
+# struct format characters for arrays of fixed size types, other than bytes, which are
+# packed in one call. Items of these types are aligned to their own size, so there is no
+# padding between them.
+FIXED_ARRAY_FORMATS = {
+    type_code: fmt for type_code, fmt in FIXED_FORMATS.items() if type_code != "y"
+}
+
+ALIGN_8_TYPE_CODES = "xtd{(r"
+
+# Zero bytes, indexed by how many are needed.
+PADDING = tuple(bytes(n) for n in range(16))
+
+# Python allows at most 20 nested blocks in a function, so values in arrays nested deeper
+# than this are written by a separately compiled writer.
+MAX_INDENT = 10
+
+# The message body (and the header) is written by a writer compiled to inline python code
+# per signature (see compile_writer below). Where the offset at which a value will be
+# written is known relative to the alignment, the padding is worked out when compiling,
+# and runs of fixed size values are packed with one struct call.
 
 
 class Marshaller:
-    def __init__(self, signature: Union[Signature, str], body):
+    __slots__ = ("signature", "buffer", "body")
+
+    def __init__(self, signature: Union[Signature, str], body, verify: bool = True):
         if isinstance(signature, str):
             signature = parse_signature(signature)
-        signature.verify(body)
+        if verify:
+            signature.verify(body)
         self.signature = signature
-
         self.buffer = bytearray()
         self.body = body
 
-        self.writers = {
-            "y": self.write_byte,
-            "b": self.write_boolean,
-            "n": self.write_int16,
-            "q": self.write_uint16,
-            "i": self.write_int32,
-            "u": self.write_uint32,
-            "x": self.write_int64,
-            "t": self.write_uint64,
-            "d": self.write_double,
-            "h": self.write_uint32,
-            "o": self.write_string,
-            "s": self.write_string,
-            "g": self.write_signature,
-            "a": self.write_array,
-            "(": self.write_struct,
-            "r": self.write_struct,
-            "{": self.write_dict_entry,
-            "v": self.write_variant,
-        }
-
     def align(self, n):
-        offset = n - len(self.buffer) % n
-        if offset == 0 or offset == n:
-            return 0
-        self.buffer.extend(bytes(offset))
+        offset = -len(self.buffer) & (n - 1)
+        self.buffer += PADDING[offset]
         return offset
 
-    def write_byte(self, byte, _=None):
-        self.buffer.append(byte)
-        return 1
+    def marshall(self):
+        self.buffer = bytearray()
+        compile_writer(self.signature)(self.buffer, self.body)
+        return self.buffer
 
-    def write_boolean(self, boolean, _=None):
-        if boolean:
-            return self.write_uint32(1)
-        else:
-            return self.write_uint32(0)
-
-    def write_int16(self, int16, _=None):
-        written = self.align(2)
-        self.buffer.extend(pack("<h", int16))
-        return written + 2
-
-    def write_uint16(self, uint16, _=None):
-        written = self.align(2)
-        self.buffer.extend(pack("<H", uint16))
-        return written + 2
-
-    def write_int32(self, int32, _):
-        written = self.align(4)
-        self.buffer.extend(pack("<i", int32))
-        return written + 4
-
-    def write_uint32(self, uint32, _=None):
-        written = self.align(4)
-        self.buffer.extend(pack("<I", uint32))
-        return written + 4
-
-    def write_int64(self, int64, _=None):
-        written = self.align(8)
-        self.buffer.extend(pack("<q", int64))
-        return written + 8
-
-    def write_uint64(self, uint64, _=None):
-        written = self.align(8)
-        self.buffer.extend(pack("<Q", uint64))
-        return written + 8
-
-    def write_double(self, double, _=None):
-        written = self.align(8)
-        self.buffer.extend(pack("<d", double))
-        return written + 8
-
-    def write_signature(self, signature: Union[Signature, str], _=None):
-        if isinstance(signature, Signature):
-            signature = signature.text
-        signature = signature.encode("ASCII")
-        signature_len = len(signature)
-        self.buffer.append(signature_len)
-        self.buffer.extend(signature)
-        self.buffer.append(0)
-        return signature_len + 2
-
-    def write_string(self, value: str, _=None):
-        value = value.encode()
-        value_len = len(value)
-        written = self.write_uint32(value_len)
-        self.buffer.extend(value)
-        written += value_len
-        self.buffer.append(0)
-        written += 1
-        return written
-
-    def write_variant(self, variant: Variant, _=None):
-        written = self.write_signature(variant.signature)
-        written += self.write_single(variant.signature, variant.value)
-        return written
-
-    def write_array(self, array, signature: Signature):
-        # TODO max array size is 64MiB (67108864 bytes)
-        written = self.align(4)
-        # length placeholder
-        offset = len(self.buffer)
-        written += self.write_uint32(0)
-        child_type = signature.children[0]
 
-        if child_type.type_code in "xtd{(r":
-            # the first alignment is not included in array size
-            written += self.align(8)
-
-        array_len = 0
-        if child_type.type_code == "{":
-            for key, value in array.items():
-                array_len += self.write_dict_entry([key, value], child_type)
-        elif child_type.type_code == "y":
-            array_len = len(array)
-            self.buffer.extend(array)
-        else:
-            for value in array:
-                array_len += self.write_single(child_type, value)
+@lru_cache(maxsize=1024)
+def compile_writer(signature: Signature) -> Callable[[bytearray, Any], None]:
+    """Compile a function that writes a message body of the given signature.
 
-        array_len_packed = pack("<I", array_len)
-        for i in range(offset, offset + 4):
-            self.buffer[i] = array_len_packed[i - offset]
+    The returned function takes the buffer, which must start at an 8 byte boundary of
+    the message, and the body, and appends the marshalled body to the buffer.
+    """
+    compiler = _WriterCompiler(8)
+    compiler.lines.append("def write(buffer, value):")
+    compiler.write(signature, "value", 1)
+    return compiler.compile(f"<writer {signature.text!r}>")
 
-        return written + array_len
 
-    def write_struct(self, array, signature: Signature):
-        written = self.align(8)
-        for signature, value in zip(signature.children, array):
-            written += self.write_single(signature, value)
-        return written
+@lru_cache(maxsize=1024)
+def compile_variant_writer(signature: Signature) -> Callable[[bytearray, Any], None]:
+    """Compile a function that writes a variant of the given signature.
 
-    def write_dict_entry(self, dict_entry, signature: Signature):
-        written = self.align(8)
-        written += self.write_single(signature.children[0], dict_entry[0])
-        written += self.write_single(signature.children[1], dict_entry[1])
-        return written
+    The returned function takes the buffer and the value of the variant, and appends the
+    signature and the value to the buffer.
+    """
+    compiler = _WriterCompiler(1)
+    compiler.lines.append("def write(buffer, value):")
+    text = signature.text.encode("ascii")
+    compiler.add_fixed(f"{len(text) + 2}s", repr(bytes((len(text),)) + text + b"\0"), 1)
+    compiler.write(signature, "value", 1)
+    return compiler.compile(f"<variant writer {signature.text!r}>")
 
-    def write_single(self, signature: Signature, body):
-        t = signature.type_code
 
-        if t not in self.writers:
-            raise NotImplementedError(f"type isn't implemented yet: {t!r}")
+@lru_cache(maxsize=1024)
+def compile_type_writer(signature: Signature) -> Callable[[bytearray, Any], None]:
+    """Compile a function that writes a value of the given single complete type.
 
-        return self.writers[t](body, signature)
+    The returned function takes the buffer, at any offset, and the value, and appends the
+    marshalled value to the buffer.
+    """
+    compiler = _WriterCompiler(1)
+    compiler.lines.append("def write(buffer, value):")
+    compiler.write(signature, "value", 1)
+    return compiler.compile(f"<type writer {signature.text!r}>")
 
-    def marshall(self):
-        self.buffer.clear()
-        for signature, value in zip(self.signature.children, self.body):
-            self.write_single(signature, value)
-        return self.buffer
+
+class _WriterCompiler:
+    def __init__(self, alignment: int):
+        self.lines: List[str] = []
+        self.var_count = 0
+        self.namespace: Dict[str, Any] = {
+            "PADDING": PADDING,
+            "Signature": Signature,
+            "compile_variant_writer": compile_variant_writer,
+            "pack": pack,
+            "pack_into_u": UINT32_STRUCT.pack_into,
+        }
+        # The offset of the next value written is known to be position modulo alignment.
+        self.alignment = alignment
+        self.position = 0
+        # Fixed size values (and padding) still to be written, with one struct pack call.
+        self.pending_format = ""
+        self.pending_args: List[str] = []
+
+    def compile(self, filename: str) -> Callable[[bytearray, Any], None]:
+        self.flush(1)
+        if len(self.lines) == 1:
+            self.lines.append("    pass")
+        source = "\n".join(self.lines)
+        exec(compile(source, filename, "exec"), self.namespace)
+        return self.namespace["write"]
+
+    def new_var(self) -> str:
+        self.var_count += 1
+        return f"v{self.var_count}"
+
+    def emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+
+    def flush(self, indent: int):
+        """Emit the code to write the pending fixed size values."""
+        if self.pending_args:
+            struct = Struct("<" + self.pending_format)
+            name = f"pack_{self.new_var()}"
+            self.namespace[name] = struct.pack
+            self.emit(indent, f"buffer += {name}({', '.join(self.pending_args)})")
+        elif self.pending_format:
+            self.emit(indent, f"buffer += {bytes(Struct(self.pending_format).size)!r}")
+        self.pending_format = ""
+        self.pending_args = []
+
+    def forget_position(self):
+        """The offset of the next value depends on the values written."""
+        self.alignment = 1
+        self.position = 0
+
+    def align(self, n: int, indent: int):
+        if n <= self.alignment:
+            padding = -self.position & (n - 1)
+            if padding:
+                self.pending_format += f"{padding}x"
+                self.position = (self.position + padding) % self.alignment
+            return
+        if self.pending_format and not self.pending_args:
+            # Only padding is pending, so write that and the alignment padding together.
+            pending = Struct(self.pending_format).size
+            self.emit(
+                indent, f"buffer += PADDING[{pending} + (-(len(buffer) + {pending}) & {n - 1})]"
+            )
+            self.pending_format = ""
+        else:
+            self.flush(indent)
+            self.emit(indent, f"buffer += PADDING[-len(buffer) & {n - 1}]")
+        self.alignment = n
+        self.position = 0
+
+    def add_fixed(self, fmt: str, arg: str, size: int):
+        self.pending_format += fmt
+        self.pending_args.append(arg)
+        self.position = (self.position + size) % self.alignment
+
+    def write(self, signature: Signature, value: str, indent: int):
+        """Emit the code to write the value held in the variable value."""
+        type_code = signature.type_code
+
+        if type_code in FIXED_FORMATS:
+            size = FIXED_SIZES[type_code]
+            self.align(size, indent)
+            if type_code == "b":
+                value = f"1 if {value} else 0"
+            self.add_fixed(FIXED_FORMATS[type_code], value, size)
+        elif type_code in "sog":
+            encoded = self.new_var()
+            if type_code == "g":
+                self.emit(
+                    indent,
+                    f"{encoded} = ({value}.text if isinstance({value}, Signature) else {value})"
+                    '.encode("ascii")',
+                )
+                self.add_fixed("B", f"len({encoded})", 1)
+            else:
+                self.emit(indent, f"{encoded} = {value}.encode()")
+                self.align(4, indent)
+                self.add_fixed("I", f"len({encoded})", 4)
+            self.flush(indent)
+            self.emit(indent, f"buffer += {encoded}")
+            self.forget_position()
+            # nul terminator
+            self.pending_format += "x"
+        elif type_code == "v":
+            self.flush(indent)
+            self.emit(indent, f"compile_variant_writer({value}.signature)(buffer, {value}.value)")
+            self.forget_position()
+        elif type_code in "(r":
+            if type_code == "(":
+                self.align(8, indent)
+            children = signature.children
+            if children:
+                values = [self.new_var() for _ in children]
+                self.emit(indent, f"{', '.join(values)}, = {value}")
+                for child, child_value in zip(children, values):
+                    self.write(child, child_value, indent)
+        elif type_code == "a":
+            if indent > MAX_INDENT:
+                self.flush(indent)
+                name = f"write_{self.new_var()}"
+                self.namespace[name] = compile_type_writer(signature)
+                self.emit(indent, f"{name}(buffer, {value})")
+                self.forget_position()
+            else:
+                self.write_array(signature, value, indent)
+        else:
+            raise NotImplementedError(f"type isn't implemented yet: {type_code!r}")
+
+    def write_array(self, signature: Signature, value: str, indent: int):
+        # TODO max array size is 64MiB (67108864 bytes)
+        child = signature.children[0]
+        child_type_code = child.type_code
+        start = self.new_var()
+        length_offset = self.new_var()
+
+        self.align(4, indent)
+        # length placeholder
+        self.add_fixed("I", "0", 4)
+        if child_type_code in ALIGN_8_TYPE_CODES and self.alignment < 8:
+            self.flush(indent)
+            self.emit(indent, f"{length_offset} = len(buffer) - 4")
+            # the first alignment is not included in array size
+            self.align(8, indent)
+            self.flush(indent)
+            self.emit(indent, f"{start} = len(buffer)")
+        else:
+            padding = 0
+            if child_type_code in ALIGN_8_TYPE_CODES:
+                padding = -self.position & 7
+                self.align(8, indent)
+            self.flush(indent)
+            self.emit(indent, f"{start} = len(buffer)")
+            self.emit(indent, f"{length_offset} = {start} - {4 + padding}")
+
+        if child_type_code == "y":
+            self.emit(indent, f"buffer += {value}")
+        elif child_type_code in FIXED_ARRAY_FORMATS:
+            # Pack the whole array with one C level call, rather than a call per item.
+            fmt = FIXED_ARRAY_FORMATS[child_type_code]
+            self.emit(indent, f'buffer += pack(f"<{{len({value})}}{fmt}", *{value})')
+        else:
+            item = self.new_var()
+            if child_type_code == "{":
+                key = self.new_var()
+                self.emit(indent, f"for {key}, {item} in {value}.items():")
+                self.forget_position()
+                self.align(8, indent + 1)
+                self.write(child.children[0], key, indent + 1)
+                self.write(child.children[1], item, indent + 1)
+            else:
+                self.emit(indent, f"for {item} in {value}:")
+                self.forget_position()
+                self.write(child, item, indent + 1)
+            self.flush(indent + 1)
+
+        self.emit(indent, f"pack_into_u(buffer, {length_offset}, len(buffer) - {start})")
+        self.forget_position()
@@ -1,11 +1,10 @@
-import codecs
 import io
 import socket
 import sys
 from dataclasses import dataclass
-from functools import partial
-from struct import Struct
-from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from functools import lru_cache, partial
+from struct import Struct, calcsize, unpack_from
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 from ..constants import MessageFlag, MessageType
 from ..errors import InvalidMessageError
@@ -18,20 +17,23 @@ from .constants import (
     HeaderField,
 )
 
-# This is unfortunately slower than the version from dbus-next. The reason why version
-# from dbus-next is faster is it inlines the align, read_byte, and read_range code,
-# hence reducing function calls. For now, I prefer the code reuse, as it makes the
-# code more readable.
+# The version from dbus-next is fast because it inlines the align, read_byte, and
+# read_range code, hence reducing function calls. We keep the small helper methods
+# for readability, but the per-field hot paths (read_item for fixed size types, and
+# read_uint32) inline the alignment and range arithmetic, and BodyReader uses
+# __slots__ so that the offset attribute access is as cheap as possible.
 #
-# Potential solutions to get back the performance:
+# The message body is read with a reader compiled to inline python code per signature
+# (see compile_reader below). BodyReader is still used for the header fields.
+#
+# Potential solutions to get back more performance:
 # * Make the BodyReader methods, and the read_xxx methods cython methods.
-# * Compile signature into inline python code
 
 
 class Unmarshaller:
     def __init__(self, stream_or_socket: Union[io.BufferedIOBase, socket.socket]):
         if isinstance(stream_or_socket, io.BufferedIOBase):
-            self.read = partial(read_stream, stream_or_socket)
+            self.read = StreamReader(stream_or_socket)
         elif isinstance(stream_or_socket, socket.socket):
             self.read = SocketReader(stream_or_socket)
         else:
@@ -75,69 +77,121 @@ class Unmarshaller:
             return self.message
 
 
-def read_stream(stream: io.RawIOBase, size: int) -> Tuple[bytes, Iterable[int]]:
-    data = stream.read(size)
-    if data == b"":
-        raise EOFError()
-    return data, ()
-
-
 MAX_UNIX_FDS = 16
 FD_STRUCT = Struct("I")  # What about endian
 FD_CMSG_LEN = socket.CMSG_LEN(MAX_UNIX_FDS * FD_STRUCT.size)
+# Don't hold on to the buffers of big messages between reads.
+MAX_SPARE_BUFFER_SIZE = 64 * 1024
+MIN_BUFFER_SIZE = 4096
+
+
+class StreamReader:
+    # Reads from a stream into a buffer that is reused between reads. This does not
+    # support resuming a partial read, so the stream should be blocking.
+
+    def __init__(self, stream: io.BufferedIOBase):
+        self.stream = stream
+        self.buffer: Optional[memoryview] = None
+
+    def __call__(self, size: int) -> Tuple[memoryview, Tuple[int, ...]]:
+        # The caller must be done with the returned view before calling again, as the
+        # buffer is reused for the next read.
+        buffer = self.buffer
+        if buffer is None or len(buffer) < size:
+            buffer = memoryview(bytearray(max(size, MIN_BUFFER_SIZE)))
+            if len(buffer) <= MAX_SPARE_BUFFER_SIZE:
+                self.buffer = buffer
+        view = buffer[:size]
+        read_size = self.stream.readinto(view)
+        if read_size is None:
+            # non blocking stream with no data available
+            raise BlockingIOError()
+        if read_size < size:
+            # a blocking stream only returns less than asked for at the end of the stream
+            raise EOFError()
+        return view, ()
 
 
 class SocketReader:
     # This basically does what socket.SocketIO + BufferedReader does, but:
     # 1. It won't return unless the full requested size is received
     # 2. It handles receiving unix fd's
+    # 3. It reads into a buffer that is reused between reads
 
     def __init__(self, sock: socket.socket):
         self.sock = sock
-        self.buffer: bytearray = None
-        self.view: memoryview = None
-        self.unix_fds: List[int] = None
-        self.recv_size: int = 0
-
-    def __call__(self, size: int):
-        if self.buffer is None:
-            self.buffer = bytearray(size)
-            self.view = memoryview(self.buffer)
-            self.unix_fds = list()
-            self.recv_size = 0
+        # State of a read that has only been partially received.
+        self.view: Optional[memoryview] = None
+        self.unix_fds: Optional[List[int]] = None
+        self.recv_size = 0
+        # A view of the whole buffer that is reused between reads.
+        self.buffer: Optional[memoryview] = None
+
+    def __call__(self, size: int) -> Tuple[memoryview, List[int]]:
+        # The caller must be done with the returned view before calling again, as the
+        # buffer is reused for the next read.
+        if self.view is None:
+            buffer = self.buffer
+            if buffer is None or len(buffer) < size:
+                # Allocate at least MIN_BUFFER_SIZE, so that the header and body of most
+                # messages can be read into the same buffer.
+                buffer = memoryview(bytearray(max(size, MIN_BUFFER_SIZE)))
+                if len(buffer) <= MAX_SPARE_BUFFER_SIZE:
+                    self.buffer = buffer
+            view = buffer[:size]
+            unix_fds = []
+            recv_size = 0
         else:
-            # Due to the way this get's called by unmarshall, the buffer len should always equal the size
-            assert len(self.buffer) == size
-
-        while self.recv_size < size:
-            recv_size, ancdata, *_ = self.sock.recvmsg_into(
-                (self.view[self.recv_size :],), FD_CMSG_LEN
-            )
-            if recv_size == 0:
-                raise EOFError()
-            for level, type_, data in ancdata:
-                if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
-                    for fd_item in FD_STRUCT.iter_unpack(data):
-                        self.unix_fds.append(fd_item[0])
-            self.recv_size += recv_size
-        else:
-            ret = self.buffer, self.unix_fds
-            self.buffer = None
-            self.view = None
-            self.unix_fds = None
-            return ret
+            view = self.view
+            unix_fds = self.unix_fds
+            recv_size = self.recv_size
+            # Due to the way this get's called by unmarshall, the view len should always equal the size
+            assert len(view) == size
+
+        recvmsg_into = self.sock.recvmsg_into
+        try:
+            while recv_size < size:
+                # Only slice the view if we have had a partial read. Normally the whole
+                # message is received in one go.
+                read_size, ancdata, *_ = recvmsg_into(
+                    (view[recv_size:] if recv_size else view,), FD_CMSG_LEN
+                )
+                if read_size == 0:
+                    raise EOFError()
+                for level, type_, data in ancdata:
+                    if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+                        for fd_item in FD_STRUCT.iter_unpack(data):
+                            unix_fds.append(fd_item[0])
+                recv_size += read_size
+        except BlockingIOError:
+            self.view = view
+            self.unix_fds = unix_fds
+            self.recv_size = recv_size
+            raise
+
+        self.view = None
+        self.unix_fds = None
+        return view, unix_fds
 
 
 HEADER_SIGNATURE_SIZE = 16
 HEADER_FIELD_SIGNATURE = parse_single_type("(yv)")
-HEADER_UNPACK_LENGTHS = {BIG_ENDIAN: Struct(">III"), LITTLE_ENDIAN: Struct("<III")}
-
-UTF_8 = codecs.lookup("utf-8")
-ASCII = codecs.lookup("ascii")
+HEADER_STRUCTS = {BIG_ENDIAN: Struct(">BBBBIII"), LITTLE_ENDIAN: Struct("<BBBBIII")}
 
 UNPACK_SYMBOL = {LITTLE_ENDIAN: "<", BIG_ENDIAN: ">"}
+HOST_ENDIAN = LITTLE_ENDIAN if sys.byteorder == "little" else BIG_ENDIAN
+
+
+def _unpack_struct(endian: int, ctype: str) -> Struct:
+    # For messages in the host's byte order, use native mode where the native size is the
+    # same as the standard size, as struct can then copy the value without byte swapping.
+    if endian == HOST_ENDIAN and calcsize(ctype) == calcsize(f"={ctype}"):
+        return Struct(ctype)
+    return Struct(f"{UNPACK_SYMBOL[endian]}{ctype}")
+
+
 STRUCT_BY_ENDIAN_DBUS_TYPE: Dict[Tuple[int, str], Struct] = {
-    (endian, dbus_type): Struct(f"{UNPACK_SYMBOL[endian]}{ctype}")
+    (endian, dbus_type): _unpack_struct(endian, ctype)
     for endian in (BIG_ENDIAN, LITTLE_ENDIAN)
     for dbus_type, ctype in (
         ("n", "h"),  # int16
@@ -150,6 +204,16 @@ STRUCT_BY_ENDIAN_DBUS_TYPE: Dict[Tuple[int, str], Struct] = {
         ("h", "I"),  # uint32
     )
 }
+# Pre-bound (size, unpack_from) for each fixed size type, so that BodyReader does not need
+# to build a tuple key and look up the Struct for every value it reads.
+UNPACKERS_BY_ENDIAN: Dict[int, Dict[str, Tuple[int, Callable[..., Tuple[Any, ...]]]]] = {
+    endian: {
+        dbus_type: (struct.size, struct.unpack_from)
+        for (struct_endian, dbus_type), struct in STRUCT_BY_ENDIAN_DBUS_TYPE.items()
+        if struct_endian == endian
+    }
+    for endian in (BIG_ENDIAN, LITTLE_ENDIAN)
+}
 
 
 @dataclass(init=False, **(dict(slots=True) if sys.version_info >= (3, 10) else dict()))
@@ -169,22 +233,29 @@ def read_header(buffer: bytes):
 
     # Signature is of the header is
     # BYTE, BYTE, BYTE, BYTE, UINT32, UINT32, ARRAY of STRUCT of (BYTE,VARIANT)
-    header = Header()
-    header.endian = buffer[0]
-    header.message_type = MessageType(buffer[1])
-    header.flag = MessageFlag(buffer[2])
-    header.protocol_version = buffer[3]
-
-    if header.endian != LITTLE_ENDIAN and header.endian != BIG_ENDIAN:
+    # The fixed part, up to the length of the array, is unpacked in one go.
+    header_struct = HEADER_STRUCTS.get(buffer[0])
+    if header_struct is None:
         raise InvalidMessageError(
-            f"Expecting endianness as the first byte, got {header.endian} from {buffer}"
+            f"Expecting endianness as the first byte, got {buffer[0]} from {bytes(buffer)}"
         )
+
+    header = Header()
+    (
+        header.endian,
+        message_type,
+        flag,
+        header.protocol_version,
+        header.body_len,
+        header.serial,
+        header.header_len,
+    ) = header_struct.unpack_from(buffer)
+    header.message_type = MessageType(message_type)
+    header.flag = MessageFlag(flag)
+
     if header.protocol_version != PROTOCOL_VERSION:
         raise InvalidMessageError(f"got unknown protocol version: {header.protocol_version}")
 
-    header.body_len, header.serial, header.header_len = HEADER_UNPACK_LENGTHS[
-        header.endian
-    ].unpack_from(buffer, 4)
     header.msg_len = header.header_len + (-header.header_len & 7) + header.body_len  # align 8
     return header
 
@@ -195,7 +266,10 @@ def read_body(buffer: bytes, header: Header, unix_fds: Sequence[int]):
     header_fields = dict(body_reader.read_header_fields(header.header_len))
     signature = parse_signature(header_fields.get(HeaderField.SIGNATURE, ""))
     body_reader.align(8)
-    body = [body_reader.read_item(t) for t in signature.children] if header.body_len else []
+    if header.body_len:
+        body, _ = compile_reader(signature, header.endian)(body_reader.buffer, body_reader.offset)
+    else:
+        body = []
 
     return Message(
         destination=header_fields.get(HeaderField.DESTINATION),
@@ -211,16 +285,19 @@ def read_body(buffer: bytes, header: Header, unix_fds: Sequence[int]):
         signature=signature,
         body=body,
         serial=header.serial,
+        _trusted=True,
     )
 
 
 class BodyReader:
-    slots = ["buffer", "offset", "endian"]
+    __slots__ = ("buffer", "offset", "endian", "unpackers", "unpack_uint32")
 
     def __init__(self, buffer: bytes, endian: int):
         self.buffer = memoryview(buffer)
         self.endian = endian
         self.offset = 0
+        self.unpackers = UNPACKERS_BY_ENDIAN[endian]
+        self.unpack_uint32 = self.unpackers["u"][1]
 
     def align(self, align: int):
         # Alignment padding is handled with the following formula below
@@ -259,19 +336,21 @@ class BodyReader:
             yield HeaderField(field_id), field_value.value
 
     def read_uint32(self) -> int:
-        struct = STRUCT_BY_ENDIAN_DBUS_TYPE[(self.endian, "u")]
-        self.align(struct.size)
-        buffer = self.read_range(struct.size)
-        return struct.unpack_from(buffer)[0]
+        # align(4) and read_range(4) inlined
+        offset = self.offset + (-self.offset & 3)
+        self.offset = offset + 4
+        return self.unpack_uint32(self.buffer, offset)[0]
 
     def read_item(self, signature: Signature) -> Any:
         """Dispatch to an argument reader or cast/unpack a C type."""
         type_code = signature.type_code
 
-        if ctype_struct := STRUCT_BY_ENDIAN_DBUS_TYPE.get((self.endian, type_code)):
-            self.align(ctype_struct.size)
-            buffer = self.read_range(ctype_struct.size)
-            return ctype_struct.unpack_from(buffer)[0]
+        if unpacker := self.unpackers.get(type_code):
+            # align and read_range inlined, as this is the hottest path
+            size, unpack_from = unpacker
+            offset = self.offset + (-self.offset & (size - 1))
+            self.offset = offset + size
+            return unpack_from(self.buffer, offset)[0]
 
         if complex_reader := self.COMPLEX_PARSERS.get(type_code):
             return complex_reader(self, signature)
@@ -280,18 +359,22 @@ class BodyReader:
         return bool(self.read_uint32())
 
     def read_string(self, _):
-        string_length = self.read_uint32()
-        bytes_ = self.read_range(string_length)
+        # read_uint32, read_range and read_byte inlined
+        start = self.offset + (-self.offset & 3) + 4
+        end = start + self.unpack_uint32(self.buffer, start - 4)[0]
         # Check for the terminating '\0'
-        assert self.read_byte() == 0
-        return UTF_8.decode(bytes_)[0]
+        assert self.buffer[end] == 0
+        self.offset = end + 1
+        return str(self.buffer[start:end], "utf-8")
 
     def read_signature(self, _=None):
-        signature_len = self.read_byte()
-        bytes_ = self.read_range(signature_len)
+        # read_byte, read_range and read_byte inlined
+        start = self.offset + 1
+        end = start + self.buffer[self.offset]
         # Check for the terminating '\0'
-        assert self.read_byte() == 0
-        return ASCII.decode(bytes_)[0]
+        assert self.buffer[end] == 0
+        self.offset = end + 1
+        return str(self.buffer[start:end], "ascii")
 
     def read_variant(self, _=None):
         signature = parse_single_type(self.read_signature())
@@ -300,35 +383,40 @@ class BodyReader:
 
     def read_struct(self, signature: Signature):
         self.align(8)
-        return [self.read_item(child_type) for child_type in signature.children]
+        read_item = self.read_item
+        return [read_item(child_type) for child_type in signature.children]
 
     def read_array(self, signature: Signature):
         array_length = self.read_uint32()
 
         child_signature = signature.children[0]
+        child_type_code = child_signature.type_code
 
-        if child_signature.type_code == "y":
+        if child_type_code == "y":
             return self.read_range(array_length).tobytes()
 
-        if child_signature.type_code in "xtd{(":
+        if child_type_code in "xtd{(":
             # the first alignment is not included in the array size, so align before
             # calculating stop_offset
             self.align(8)
 
         stop_offset = self.offset + array_length - 1
 
-        if child_signature.type_code == "{":
+        read_item = self.read_item
+
+        if child_type_code == "{":
+            key_signature, value_signature = child_signature.children
             result_dict = {}
             while self.offset < stop_offset:
                 self.align(8)
-                key = self.read_item(child_signature.children[0])
-                value = self.read_item(child_signature.children[1])
-                result_dict[key] = value
+                key = read_item(key_signature)
+                result_dict[key] = read_item(value_signature)
             return result_dict
 
         result_list = []
+        append = result_list.append
         while self.offset < stop_offset:
-            result_list.append(self.read_item(child_signature))
+            append(read_item(child_signature))
         return result_list
 
     COMPLEX_PARSERS: Dict[str, Callable[["BodyReader", Signature], Any]] = {
@@ -341,3 +429,185 @@ class BodyReader:
         "(": read_struct,
         "v": read_variant,
     }
+
+
+# Compiled readers
+#
+# Rather than walking the signature tree, and dispatching through read_item for every
+# value, we generate the python source for a function that reads a specific signature,
+# with the align, read_range and unpack code inlined. The generated function is compiled
+# once per signature and endian, and cached.
+
+ALIGN_8_TYPE_CODES = "xtd{("
+
+# struct format characters for the fixed size types that arrays are read in one call for.
+FIXED_ARRAY_FORMATS = {
+    "n": "h",
+    "q": "H",
+    "i": "i",
+    "u": "I",
+    "x": "q",
+    "t": "Q",
+    "d": "d",
+    "h": "I",
+}
+
+# Python allows at most 20 nested blocks in a function, so values in arrays nested deeper
+# than this are read by a separately compiled reader.
+MAX_INDENT = 10
+
+
+@lru_cache(maxsize=1024)
+def compile_reader(
+    signature: Signature, endian: int
+) -> Callable[[memoryview, int], Tuple[Any, int]]:
+    """Compile a function that reads a value of the given signature.
+
+    The returned function takes the buffer and offset to start reading at, and returns a
+    tuple of the value read and the offset after the value.
+    """
+    compiler = _ReaderCompiler(endian)
+    compiler.lines.append("def read(buffer, offset):")
+    if signature.type_code == "r":
+        # the body of a message. Same as a struct, but it is not aligned
+        value = compiler.read_children(signature.children, 1)
+    else:
+        value = compiler.read(signature, 1)
+    compiler.lines.append(f"    return {value}, offset")
+
+    source = "\n".join(compiler.lines)
+    namespace = compiler.namespace
+    exec(compile(source, f"<reader {signature.text!r}>", "exec"), namespace)
+    return namespace["read"]
+
+
+def _read_variant(buffer: memoryview, offset: int, endian: int) -> Tuple[Variant, int]:
+    signature_len = buffer[offset]
+    signature = parse_single_type(str(buffer[offset + 1 : offset + 1 + signature_len], "ascii"))
+    value, offset = compile_reader(signature, endian)(buffer, offset + signature_len + 2)
+    # verify in Variant is only useful on construction not unmarshalling
+    return Variant(signature, value, verify=False), offset
+
+
+class _ReaderCompiler:
+    def __init__(self, endian: int):
+        self.lines: List[str] = []
+        self.var_count = 0
+        self.unpackers = UNPACKERS_BY_ENDIAN[endian]
+        self.endian = endian
+        self.namespace = {
+            "read_variant": partial(_read_variant, endian=endian),
+            "unpack_from": unpack_from,
+        }
+        for type_code, (_, unpack) in self.unpackers.items():
+            self.namespace[f"unpack_{type_code}"] = unpack
+
+    def new_var(self) -> str:
+        self.var_count += 1
+        return f"v{self.var_count}"
+
+    def emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+
+    def read_children(self, children: Sequence[Signature], indent: int) -> str:
+        values = [self.read(child, indent) for child in children]
+        return f"[{', '.join(values)}]"
+
+    def read(self, signature: Signature, indent: int) -> str:
+        """Emit the code to read a value of signature, and return the name of the variable
+        that will hold the value."""
+        type_code = signature.type_code
+        var = self.new_var()
+
+        if type_code == "y":
+            self.emit(indent, f"{var} = buffer[offset]")
+            self.emit(indent, "offset += 1")
+        elif type_code == "b":
+            self.emit(indent, "offset += -offset & 3")
+            self.emit(indent, f"{var} = bool(unpack_u(buffer, offset)[0])")
+            self.emit(indent, "offset += 4")
+        elif type_code in self.unpackers:
+            size = self.unpackers[type_code][0]
+            self.emit(indent, f"offset += -offset & {size - 1}")
+            self.emit(indent, f"{var} = unpack_{type_code}(buffer, offset)[0]")
+            self.emit(indent, f"offset += {size}")
+        elif type_code in "so":
+            length = self.new_var()
+            self.emit(indent, "offset += -offset & 3")
+            self.emit(indent, f"{length} = unpack_u(buffer, offset)[0] + offset + 4")
+            self.emit(indent, f'{var} = str(buffer[offset + 4 : {length}], "utf-8")')
+            # Check for the terminating '\0'
+            self.emit(indent, f"assert buffer[{length}] == 0")
+            self.emit(indent, f"offset = {length} + 1")
+        elif type_code == "g":
+            length = self.new_var()
+            self.emit(indent, f"{length} = buffer[offset] + offset + 1")
+            self.emit(indent, f'{var} = str(buffer[offset + 1 : {length}], "ascii")')
+            # Check for the terminating '\0'
+            self.emit(indent, f"assert buffer[{length}] == 0")
+            self.emit(indent, f"offset = {length} + 1")
+        elif type_code == "v":
+            self.emit(indent, f"{var}, offset = read_variant(buffer, offset)")
+        elif type_code == "(":
+            self.emit(indent, "offset += -offset & 7")
+            self.emit(indent, f"{var} = {self.read_children(signature.children, indent)}")
+        elif type_code == "a":
+            if indent > MAX_INDENT:
+                name = f"read_{var}"
+                self.namespace[name] = compile_reader(signature, self.endian)
+                self.emit(indent, f"{var}, offset = {name}(buffer, offset)")
+            else:
+                self.read_array(signature, var, indent)
+        else:
+            raise NotImplementedError(f"type isn't implemented yet: {type_code!r}")
+
+        return var
+
+    def read_array(self, signature: Signature, var: str, indent: int):
+        child_signature = signature.children[0]
+        stop_offset = self.new_var()
+
+        self.emit(indent, "offset += -offset & 3")
+        self.emit(indent, f"{stop_offset} = unpack_u(buffer, offset)[0]")
+        self.emit(indent, "offset += 4")
+
+        if child_signature.type_code == "y":
+            self.emit(indent, f"{var} = buffer[offset : offset + {stop_offset}].tobytes()")
+            self.emit(indent, f"offset += {stop_offset}")
+            return
+
+        if child_signature.type_code in ALIGN_8_TYPE_CODES:
+            # the first alignment is not included in the array size, so align before
+            # calculating stop_offset
+            self.emit(indent, "offset += -offset & 7")
+
+        self.emit(indent, f"{stop_offset} += offset")
+
+        if child_signature.type_code in FIXED_ARRAY_FORMATS:
+            # Read the whole array with one C level call, rather than an unpack per item.
+            fmt = FIXED_ARRAY_FORMATS[child_signature.type_code]
+            size = self.unpackers[child_signature.type_code][0]
+            if self.endian == HOST_ENDIAN and calcsize(fmt) == size:
+                self.emit(indent, f'{var} = buffer[offset:{stop_offset}].cast("{fmt}").tolist()')
+            else:
+                symbol = UNPACK_SYMBOL[self.endian]
+                self.emit(
+                    indent,
+                    f'{var} = list(unpack_from(f"{symbol}{{({stop_offset} - offset) // {size}}}{fmt}",'
+                    " buffer, offset))",
+                )
+            self.emit(indent, f"offset = {stop_offset}")
+            return
+
+        if child_signature.type_code == "{":
+            self.emit(indent, f"{var} = {{}}")
+            self.emit(indent, f"while offset < {stop_offset}:")
+            self.emit(indent + 1, "offset += -offset & 7")
+            key = self.read(child_signature.children[0], indent + 1)
+            value = self.read(child_signature.children[1], indent + 1)
+            self.emit(indent + 1, f"{var}[{key}] = {value}")
+        else:
+            self.emit(indent, f"{var} = []")
+            self.emit(indent, f"while offset < {stop_offset}:")
+            item = self.read(child_signature, indent + 1)
+            self.emit(indent + 1, f"{var}.append({item})")
@@ -16,13 +16,14 @@ def replace_fds_with_idx(
         signature = parse_signature(signature)
 
     unix_fds = []
+    fd_indexes = {}
 
     def _replace(fd):
-        try:
-            return unix_fds.index(fd)
-        except ValueError:
+        idx = fd_indexes.get(fd)
+        if idx is None:
+            idx = fd_indexes[fd] = len(unix_fds)
             unix_fds.append(fd)
-            return len(unix_fds) - 1
+        return idx
 
     return _replace_fds(body, signature, _replace), unix_fds
 
@@ -51,26 +52,28 @@ def _replace_fds(body_obj: Any, signature: Signature, replace_fn: Callable[[Any]
     allow type 'h' to be the fd directly instead of an index in an external
     array such as in the spec."""
 
-    if not any(type_code in signature.text for type_code in "hv"):
+    if not signature._contains_fd_or_variant:
         return body_obj
 
-    if signature.type_code == "h":
+    type_code = signature.type_code
+
+    if type_code == "h":
         return replace_fn(body_obj)
 
-    if signature.type_code == "v":
+    if type_code == "v":
         assert isinstance(body_obj, Variant)
         return Variant(
             body_obj.signature, _replace_fds(body_obj.value, body_obj.signature, replace_fn)
         )
 
-    if signature.type_code == "r" or signature.type_code == "(":
+    if type_code == "r" or type_code == "(":
         assert isinstance(body_obj, Sequence)
         return [
             _replace_fds(child_obj, child_sig, replace_fn)
             for child_obj, child_sig in zip(body_obj, signature.children)
         ]
 
-    if signature.type_code == "a":
+    if type_code == "a":
         item_sig = signature.children[0]
         if item_sig.type_code == "{":
             assert isinstance(body_obj, Mapping)
@@ -120,6 +123,9 @@ def parse_annotation(annotation) -> str:
 
     if type(annotation) is not str:
         raise_value_error()
+    if "'" not in annotation and '"' not in annotation:
+        # Can't be a string constant, so skip the (slow) ast.parse
+        return annotation
     try:
         body = ast.parse(annotation).body
         if len(body) == 1 and type(body[0].value) is ast.Constant:
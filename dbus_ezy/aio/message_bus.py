@@ -397,7 +397,6 @@ class MessageBus(BaseMessageBus):
             while True:
                 if self._unmarshaller.unmarshall():
                     self._on_message(self._unmarshaller.message)
-                    self._unmarshaller = self._create_unmarshaller()
                 else:
                     break
         except Exception as e:
@@ -49,7 +49,6 @@ class _MessageSource(_GLibSource):
 
                 if self.unmarshaller.unmarshall():
                     callback(self.unmarshaller.message)
-                    self.unmarshaller = None
                 else:
                     break
         except Exception as e:
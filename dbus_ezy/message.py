@@ -5,7 +5,7 @@ from ._private.constants import LITTLE_ENDIAN, PROTOCOL_VERSION, HeaderField
 from ._private.marshaller import Marshaller
 from .constants import ErrorType, MessageFlag, MessageType
 from .errors import InvalidMessageError
-from .signature import Signature, Variant, parse_signature
+from .signature import Signature, Variant, parse_signature, parse_single_type
 from .validators import (
     assert_bus_name_valid,
     assert_interface_name_valid,
@@ -13,6 +13,26 @@ from .validators import (
     assert_object_path_valid,
 )
 
+HEADER_SIGNATURE = parse_signature("yyyyuua(yv)")
+OBJECT_PATH_SIGNATURE = parse_single_type("o")
+STRING_SIGNATURE = parse_single_type("s")
+SIGNATURE_SIGNATURE = parse_single_type("g")
+UINT32_SIGNATURE = parse_single_type("u")
+
+# The header fields written from message attributes of the same name, in order, with the
+# signature of their variant, and whether the variant needs to verify the value. The names
+# and path were validated when the message was created, so don't need to be verified again.
+HEADER_FIELDS = (
+    (HeaderField.PATH.value, "path", OBJECT_PATH_SIGNATURE, False),
+    (HeaderField.INTERFACE.value, "interface", STRING_SIGNATURE, False),
+    (HeaderField.MEMBER.value, "member", STRING_SIGNATURE, False),
+    (HeaderField.ERROR_NAME.value, "error_name", STRING_SIGNATURE, False),
+    (HeaderField.REPLY_SERIAL.value, "reply_serial", UINT32_SIGNATURE, True),
+    (HeaderField.DESTINATION.value, "destination", STRING_SIGNATURE, False),
+)
+SIGNATURE_FIELD = HeaderField.SIGNATURE.value
+UNIX_FDS_FIELD = HeaderField.UNIX_FDS.value
+
 REQUIRED_FIELDS = {
     MessageType.METHOD_CALL: ("path", "member"),
     MessageType.SIGNAL: ("path", "member", "interface"),
@@ -20,6 +40,15 @@ REQUIRED_FIELDS = {
     MessageType.METHOD_RETURN: ("reply_serial",),
 }
 
+# The REQUIRED_FIELDS checks, written out for each message type, as they are done for every
+# message. When a check fails, REQUIRED_FIELDS is used to find the field that is missing.
+REQUIRED_FIELDS_PRESENT = {
+    MessageType.METHOD_CALL: lambda message: message.path and message.member,
+    MessageType.SIGNAL: lambda message: message.path and message.member and message.interface,
+    MessageType.ERROR: lambda message: message.error_name and message.reply_serial,
+    MessageType.METHOD_RETURN: lambda message: message.reply_serial,
+}
+
 
 @dataclasses.dataclass
 class Message:
@@ -83,34 +112,39 @@ class Message:
 
     body: List[Any] = dataclasses.field(default_factory=list)
     serial: int = 0
+    # Set by the unmarshaller, for messages received from the bus, to skip validating the
+    # names, which the bus has already validated.
+    _trusted: dataclasses.InitVar[bool] = False
 
-    def __post_init__(self):
-        self.flags = (
-            self.flags if type(self.flags) is MessageFlag else MessageFlag(bytes([self.flags]))
-        )
+    def __post_init__(self, _trusted: bool = False):
+        if type(self.flags) is not MessageFlag:
+            self.flags = MessageFlag(self.flags)
         self.error_name = (
             self.error_name if type(self.error_name) is not ErrorType else self.error_name.value
         )
         if isinstance(self.signature, str):
             self.signature = parse_signature(self.signature)
 
-        if self.destination is not None:
-            assert_bus_name_valid(self.destination)
-        if self.interface is not None:
-            assert_interface_name_valid(self.interface)
-        if self.path is not None:
-            assert_object_path_valid(self.path)
-        if self.member is not None:
-            assert_member_name_valid(self.member)
-        if self.error_name is not None:
-            assert_interface_name_valid(self.error_name)
-
-        required_fields = REQUIRED_FIELDS.get(self.message_type)
-        if not required_fields:
-            raise InvalidMessageError(f"got unknown message type: {self.message_type}")
-        for field in required_fields:
-            if not getattr(self, field):
-                raise InvalidMessageError(f"missing required field: {field}")
+        if not _trusted:
+            if self.destination is not None:
+                assert_bus_name_valid(self.destination)
+            if self.interface is not None:
+                assert_interface_name_valid(self.interface)
+            if self.path is not None:
+                assert_object_path_valid(self.path)
+            if self.member is not None:
+                assert_member_name_valid(self.member)
+            if self.error_name is not None:
+                assert_interface_name_valid(self.error_name)
+
+        try:
+            required_fields_present = REQUIRED_FIELDS_PRESENT[self.message_type]
+        except KeyError:
+            raise InvalidMessageError(f"got unknown message type: {self.message_type}") from None
+        if not required_fields_present(self):
+            for field in REQUIRED_FIELDS[self.message_type]:
+                if not getattr(self, field):
+                    raise InvalidMessageError(f"missing required field: {field}")
 
     @staticmethod
     def new_error(msg: "Message", error_name: str, error_text: str) -> "Message":
@@ -223,24 +257,17 @@ class Message:
         body_block = Marshaller(self.signature, self.body)
         body_block.marshall()
 
-        fields = []
-
-        if self.path:
-            fields.append([HeaderField.PATH.value, Variant("o", self.path)])
-        if self.interface:
-            fields.append([HeaderField.INTERFACE.value, Variant("s", self.interface)])
-        if self.member:
-            fields.append([HeaderField.MEMBER.value, Variant("s", self.member)])
-        if self.error_name:
-            fields.append([HeaderField.ERROR_NAME.value, Variant("s", self.error_name)])
-        if self.reply_serial:
-            fields.append([HeaderField.REPLY_SERIAL.value, Variant("u", self.reply_serial)])
-        if self.destination:
-            fields.append([HeaderField.DESTINATION.value, Variant("s", self.destination)])
+        fields = [
+            (field, Variant(signature, value, verify=verify))
+            for field, attr, signature, verify in HEADER_FIELDS
+            if (value := getattr(self, attr))
+        ]
         if self.signature.children:
-            fields.append([HeaderField.SIGNATURE.value, Variant("g", self.signature)])
+            fields.append((SIGNATURE_FIELD, Variant(SIGNATURE_SIGNATURE, self.signature)))
         if self.unix_fds and negotiate_unix_fd:
-            fields.append([HeaderField.UNIX_FDS.value, Variant("u", len(self.unix_fds))])
+            fields.append(
+                (UNIX_FDS_FIELD, Variant(UINT32_SIGNATURE, len(self.unix_fds), verify=False))
+            )
 
         header_body = [
             LITTLE_ENDIAN,
@@ -251,7 +278,9 @@ class Message:
             self.serial,
             fields,
         ]
-        header_block = Marshaller("yyyyuua(yv)", header_body)
+        # The header fields were validated when the message was created, and the header
+        # is built here, so there's no need to verify it.
+        header_block = Marshaller(HEADER_SIGNATURE, header_body, verify=False)
         header_block.marshall()
         header_block.align(8)
         return header_block.buffer + body_block.buffer
@@ -1,7 +1,7 @@
-import sys
+from array import array
 from dataclasses import InitVar, dataclass
 from functools import lru_cache
-from typing import Any, List, Mapping, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Optional, Sequence, Tuple, Union
 
 from .validators import is_object_path_valid
 
@@ -23,96 +23,205 @@ class InvalidSignatureError(ValueError):
     pass
 
 
-@lru_cache(maxsize=None)
+# Parsed signatures by text. The same few signatures are used over and over, so parsing is
+# normally just a dict lookup. These are plain dicts rather than lru_cache, as a hit is
+# cheaper. They are keyed on signatures that peers send us in variants, so they are
+# cleared if they get too big.
+MAX_CACHED_SIGNATURES = 1024
+_signature_cache: Dict[str, "Signature"] = {}
+_single_type_cache: Dict[str, Optional["Signature"]] = {}
+
+
 def parse_signature(signature_text: str) -> "Signature":
+    try:
+        return _signature_cache[signature_text]
+    except KeyError:
+        pass
+
     children = []
-    work_signature_text = signature_text
-    while work_signature_text:
-        child, work_signature_text = _parse_next(work_signature_text)
+    index = 0
+    while index < len(signature_text):
+        child, index = _parse_next(signature_text, index)
         children.append(child)
-    return Signature(signature_text, "r", tuple(children))
+    signature = Signature(signature_text, "r", tuple(children))
+
+    if len(_signature_cache) >= MAX_CACHED_SIGNATURES:
+        _signature_cache.clear()
+    _signature_cache[signature_text] = signature
+    return signature
 
 
-@lru_cache(maxsize=None)
 def parse_single_type(signature_text: str) -> "Signature":
-    signature, signature_text = _parse_next(signature_text)
-    if signature_text:
+    try:
+        return _single_type_cache[signature_text]
+    except KeyError:
+        pass
+
+    signature, index = _parse_next(signature_text, 0)
+    if index < len(signature_text):
         raise InvalidSignatureError(
-            f"more than 1 single complete type, remaining: {signature_text!r}"
+            f"more than 1 single complete type, remaining: {signature_text[index:]!r}"
         )
+
+    if len(_single_type_cache) >= MAX_CACHED_SIGNATURES:
+        _single_type_cache.clear()
+    _single_type_cache[signature_text] = signature
     return signature
 
 
-def _remove_work_text(text: str, work_text: str):
-    if not work_text:
-        return text
-    return text[: -len(work_text)]
+def _parse_next(signature_text: str, index: int) -> Tuple[Optional["Signature"], int]:
+    """Parse the single complete type that starts at index.
 
+    Returns the type, and the index after it. This is a single pass over the text, with a
+    stack of the containers that are open, rather than recursing for each container.
+    """
+    if index >= len(signature_text):
+        return None, index
+
+    # [type_code, start index, children] for each open container
+    stack: List[Tuple[str, int, List["Signature"]]] = []
+
+    while True:
+        if index >= len(signature_text):
+            type_code, _, children = stack[-1]
+            if type_code == "a":
+                raise InvalidSignatureError("missing type for array")
+            if type_code == "(":
+                raise InvalidSignatureError('missing closing ")" for struct')
+            raise _dict_entry_error(children)
+
+        type_code = signature_text[index]
+
+        if type_code in BASIC_TYPE_CODES:
+            index += 1
+            signature = BASIC_TYPES[type_code]
+        elif stack and stack[-1][0] == "{" and len(stack[-1][2]) == 2:
+            if type_code != "}":
+                raise _dict_entry_error(stack[-1][2])
+            _, start, children = stack.pop()
+            index += 1
+            signature = _container_type(signature_text[start:index], "{", children)
+        elif type_code in "a({":
+            stack.append((type_code, index, []))
+            index += 1
+            continue
+        elif type_code == ")" and stack and stack[-1][0] == "(" and stack[-1][2]:
+            _, start, children = stack.pop()
+            index += 1
+            signature = _container_type(signature_text[start:index], "(", children)
+        else:
+            raise InvalidSignatureError(f'got unexpected type_code: "{type_code}"')
+
+        # Add the type to the container it is in, completing any arrays it is the type of.
+        while stack:
+            container_type_code, start, children = stack[-1]
+            if container_type_code == "a":
+                stack.pop()
+                signature = _container_type(signature_text[start:index], "a", (signature,))
+                continue
+            if container_type_code == "{":
+                if len(children) == 2:
+                    raise _dict_entry_error(children)
+                if not children and signature.children:
+                    raise InvalidSignatureError("expected a simple type for dict entry key")
+            children.append(signature)
+            break
+        else:
+            return signature, index
 
-def _parse_next(signature_text: str) -> Tuple[Optional["Signature"], str]:
-    if not signature_text:
-        return None, ""
 
-    type_code = signature_text[0]
+def _container_type(text: str, type_code: str, children: Sequence["Signature"]) -> "Signature":
+    """Get the container type for text, so that one instance of each type is shared by all
+    the signatures it is in, rather than each having its own copy."""
+    try:
+        return _single_type_cache[text]
+    except KeyError:
+        pass
 
-    if type_code not in TYPE_CODES:
-        raise InvalidSignatureError(f'got unexpected type_code: "{type_code}"')
+    signature = Signature(text, type_code, children)
+    if len(_single_type_cache) >= MAX_CACHED_SIGNATURES:
+        _single_type_cache.clear()
+    _single_type_cache[text] = signature
+    return signature
 
-    # container types
-    if type_code == "a":
-        (child, work_signature_text) = _parse_next(signature_text[1:])
-        if not child:
-            raise InvalidSignatureError("missing type for array")
-        return (
-            Signature(_remove_work_text(signature_text, work_signature_text), "a", (child,)),
-            work_signature_text,
-        )
 
-    if type_code == "(":
-        work_signature_text = signature_text[1:]
-        children = []
-        while True:
-            (child, work_signature_text) = _parse_next(work_signature_text)
-            children.append(child)
-            if not work_signature_text:
-                raise InvalidSignatureError('missing closing ")" for struct')
-            if work_signature_text[0] == ")":
-                work_signature_text = work_signature_text[1:]
-                return (
-                    Signature(
-                        _remove_work_text(signature_text, work_signature_text), "(", tuple(children)
-                    ),
-                    work_signature_text,
-                )
+def _dict_entry_error(children: List["Signature"]) -> InvalidSignatureError:
+    if not children:
+        return InvalidSignatureError("expected a simple type for dict entry key")
+    if len(children) == 1:
+        return InvalidSignatureError("expected a value for dict entry")
+    return InvalidSignatureError('missing closing "}" for dict entry')
 
-    if type_code == "{":
-        work_signature_text = signature_text[1:]
-        (key_child, work_signature_text) = _parse_next(work_signature_text)
-        if not key_child or len(key_child.children):
-            raise InvalidSignatureError("expected a simple type for dict entry key")
-        (value_child, work_signature_text) = _parse_next(work_signature_text)
-        if not value_child:
-            raise InvalidSignatureError("expected a value for dict entry")
-        if not work_signature_text or work_signature_text[0] != "}":
-            raise InvalidSignatureError('missing closing "}" for dict entry')
-        work_signature_text = work_signature_text[1:]
-        return (
-            Signature(
-                _remove_work_text(signature_text, work_signature_text),
-                "{",
-                (key_child, value_child),
-            ),
-            work_signature_text,
-        )
 
-    # basic type
-    return (Signature(type_code, type_code, ()), signature_text[1:])
+TYPE_CODES = "ybnqiuxtdsogavh({"
+BASIC_TYPE_CODES = "ybnqiuxtdsogvh"
+# (min, max) of the integer types, other than byte.
+INTEGER_RANGES = {
+    "y": (0, 0xFF),
+    "n": (-0x8000, 0x7FFF),
+    "q": (0, 0xFFFF),
+    "i": (-0x80000000, 0x7FFFFFFF),
+    "u": (0, 0xFFFFFFFF),
+    "x": (-0x8000000000000000, 0x7FFFFFFFFFFFFFFF),
+    "t": (0, 0xFFFFFFFFFFFFFFFF),
+    "h": (0, 0xFFFFFFFF),
+}
+INTEGER_NAMES = {
+    "y": "BYTE",
+    "n": "INT16",
+    "q": "UINT16",
+    "i": "INT32",
+    "u": "UINT32",
+    "x": "INT64",
+    "t": "UINT64",
+    "h": "UNIX_FD",
+}
+
+
+def _integer_validator(type_code: str) -> Callable[["Signature", Any], None]:
+    """Make the validator for an integer type."""
+    name = INTEGER_NAMES[type_code]
+    low, high = INTEGER_RANGES[type_code]
+
+    def verify(self, body):
+        if not isinstance(body, int):
+            raise SignatureBodyMismatchError(
+                f'DBus {name} type "{type_code}" must be Python type "int", got {type(body)}'
+            )
+        if not low <= body <= high:
+            raise SignatureBodyMismatchError(
+                f'DBus {name} type "{type_code}" must be between {low} and {high}'
+            )
+
+    return verify
 
 
-TYPE_CODES = "ybnqiuxtdsogavh({"
+def _integers_in_range(body: Sequence[Any], low: int, high: int) -> bool:
+    """Check the types and range of all the members of a non empty integer array at once,
+    with loops that run in C."""
+    if isinstance(body, array) and body.typecode in ARRAY_RANGES:
+        # The array's type already limits the range of its members
+        array_low, array_high = ARRAY_RANGES[body.typecode]
+        if low <= array_low and array_high <= high:
+            return True
+    return (
+        all(issubclass(member_type, int) for member_type in set(map(type, body)))
+        and low <= min(body)
+        and max(body) <= high
+    )
+
+
+def _array_range(typecode: str) -> Tuple[int, int]:
+    bits = 8 * array(typecode).itemsize
+    if typecode.islower():
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+
+# (min, max) of the integer array.array type codes. Their sizes are platform dependent.
+ARRAY_RANGES = {typecode: _array_range(typecode) for typecode in "bBhHiIlLqQ"}
 
 
-@dataclass(frozen=True, **(dict(slots=True) if sys.version_info >= (3, 10) else dict()))
 class Signature:
     """A class that represents a signature, either a list of single complete types, or
     a single complete type.
@@ -132,133 +241,91 @@ class Signature:
 
     """
 
+    # Not a dataclass, so that it has __slots__ on all python versions, and a cheap
+    # __eq__ and __hash__. Signatures are compared and hashed a lot, e.g. as cache keys.
+    __slots__ = (
+        "text",
+        "type_code",
+        "children",
+        "_hash",
+        "_type_codes",
+        "_contains_fd_or_variant",
+        "_validator",
+        "_check",
+    )
+
     text: str
     type_code: str
-    children: Sequence["Signature"] = ()
+    children: Sequence["Signature"]
+    _hash: int
+    # The type codes of this and all its descendants.
+    _type_codes: FrozenSet[str]
+    # Whether this contains a unix fd or variant, which need handling in _replace_fds.
+    _contains_fd_or_variant: bool
+    # The validator for type_code, looked up once rather than on every verify.
+    _validator: Optional[Callable[["Signature", Any], None]]
+    # The compiled check for verify, set on first use.
+    _check: Optional[Callable[[Any], bool]]
+
+    def __init__(self, text: str, type_code: str, children: Sequence["Signature"] = ()):
+        _set = object.__setattr__
+        _set(self, "text", text)
+        _set(self, "type_code", type_code)
+        _set(self, "children", tuple(children))
+        _set(self, "_hash", hash(text))
+        # The text has the type codes of all the descendants, as well as closing brackets.
+        _set(self, "_type_codes", frozenset(text).union(type_code))
+        _set(self, "_contains_fd_or_variant", "h" in text or "v" in text)
+        _set(self, "_validator", self.validators.get(type_code))
+        _set(self, "_check", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"cannot assign to field {name!r}, Signature is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"cannot delete field {name!r}, Signature is immutable")
+
+    def __reduce__(self):
+        return Signature, (self.text, self.type_code, self.children)
+
+    def __repr__(self) -> str:
+        return (
+            f"Signature(text={self.text!r}, type_code={self.type_code!r}, "
+            f"children={self.children!r})"
+        )
 
-    # # Comment this out to get the dataclass __repr__ which shows children
+    # # Uncomment this to get a short __repr__ that does not show children
     # def __repr__(self) -> str:
     #     return f"<Signature({self.text!r})>"
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, Signature):
-            return (
-                self.text == other.text
-                and self.type_code == other.type_code
-                and other.children == other.children
-            )
+            # The text determines the children, so they don't need to be compared.
+            return self.text == other.text and self.type_code == other.type_code
         if isinstance(other, str):
             return self.text == other
         return NotImplemented
 
     def __hash__(self):
-        return self.text.__hash__()
+        return self._hash
 
     def __str__(self) -> str:
         return self.text
 
-    def _verify_byte(self, body):
-        BYTE_MIN = 0x00
-        BYTE_MAX = 0xFF
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus BYTE type "y" must be Python type "int", got {type(body)}'
-            )
-        if body < BYTE_MIN or body > BYTE_MAX:
-            raise SignatureBodyMismatchError(
-                f"DBus BYTE type must be between {BYTE_MIN} and {BYTE_MAX}"
-            )
-
     def _verify_boolean(self, body):
         if not isinstance(body, bool):
             raise SignatureBodyMismatchError(
                 f'DBus BOOLEAN type "b" must be Python type "bool", got {type(body)}'
             )
 
-    def _verify_int16(self, body):
-        INT16_MIN = -0x7FFF - 1
-        INT16_MAX = 0x7FFF
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus INT16 type "n" must be Python type "int", got {type(body)}'
-            )
-        elif body > INT16_MAX or body < INT16_MIN:
-            raise SignatureBodyMismatchError(
-                f'DBus INT16 type "n" must be between {INT16_MIN} and {INT16_MAX}'
-            )
-
-    def _verify_uint16(self, body):
-        UINT16_MIN = 0
-        UINT16_MAX = 0xFFFF
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus UINT16 type "q" must be Python type "int", got {type(body)}'
-            )
-        elif body > UINT16_MAX or body < UINT16_MIN:
-            raise SignatureBodyMismatchError(
-                f'DBus UINT16 type "q" must be between {UINT16_MIN} and {UINT16_MAX}'
-            )
-
-    def _verify_int32(self, body):
-        INT32_MIN = -0x7FFFFFFF - 1
-        INT32_MAX = 0x7FFFFFFF
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus INT32 type "i" must be Python type "int", got {type(body)}'
-            )
-        elif body > INT32_MAX or body < INT32_MIN:
-            raise SignatureBodyMismatchError(
-                f'DBus INT32 type "i" must be between {INT32_MIN} and {INT32_MAX}'
-            )
-
-    def _verify_uint32(self, body):
-        UINT32_MIN = 0
-        UINT32_MAX = 0xFFFFFFFF
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus UINT32 type "u" must be Python type "int", got {type(body)}'
-            )
-        elif body > UINT32_MAX or body < UINT32_MIN:
-            raise SignatureBodyMismatchError(
-                f'DBus UINT32 type "u" must be between {UINT32_MIN} and {UINT32_MAX}'
-            )
-
-    def _verify_int64(self, body):
-        INT64_MAX = 9223372036854775807
-        INT64_MIN = -INT64_MAX - 1
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus INT64 type "x" must be Python type "int", got {type(body)}'
-            )
-        elif body > INT64_MAX or body < INT64_MIN:
-            raise SignatureBodyMismatchError(
-                f'DBus INT64 type "x" must be between {INT64_MIN} and {INT64_MAX}'
-            )
-
-    def _verify_uint64(self, body):
-        UINT64_MIN = 0
-        UINT64_MAX = 18446744073709551615
-        if not isinstance(body, int):
-            raise SignatureBodyMismatchError(
-                f'DBus UINT64 type "t" must be Python type "int", got {type(body)}'
-            )
-        elif body > UINT64_MAX or body < UINT64_MIN:
-            raise SignatureBodyMismatchError(
-                f'DBus UINT64 type "t" must be between {UINT64_MIN} and {UINT64_MAX}'
-            )
-
     def _verify_double(self, body):
         if not isinstance(body, float) and not isinstance(body, int):
             raise SignatureBodyMismatchError(
                 f'DBus DOUBLE type "d" must be Python type "float" or "int", got {type(body)}'
             )
 
-    def _verify_unix_fd(self, body):
-        try:
-            self._verify_uint32(body)
-        except SignatureBodyMismatchError:
-            raise SignatureBodyMismatchError('DBus UNIX_FD type "h" must be a valid UINT32')
-
     def _verify_object_path(self, body):
         if not is_object_path_valid(body):
             raise SignatureBodyMismatchError(
@@ -286,28 +353,44 @@ class Signature:
     def _verify_array(self, body):
         child_type = self.children[0]
 
-        if child_type.type_code == "{":
+        if child_type.type_code == "y":
+            if not isinstance(body, (bytearray, bytes)):
+                raise SignatureBodyMismatchError(
+                    f'DBus ARRAY type "a" with BYTE child must be Python type "bytes", got {type(body)}'
+                )
+                # no need to verify children
+        elif child_type.type_code == "{":
             if not isinstance(body, Mapping):
                 raise SignatureBodyMismatchError(
                     'DBus ARRAY type "a" with DICT_ENTRY child must be Python '
                     f'type "Mapping", e.g. "dict", got {type(body)}'
                 )
+            key_type, value_type = child_type.children
+            verify_key = key_type.verify
+            verify_value = value_type.verify
             for key, value in body.items():
-                child_type.children[0].verify(key)
-                child_type.children[1].verify(value)
-        elif child_type.type_code == "y":
-            if not isinstance(body, (bytearray, bytes)):
-                raise SignatureBodyMismatchError(
-                    f'DBus ARRAY type "a" with BYTE child must be Python type "bytes", got {type(body)}'
-                )
-                # no need to verify children
+                verify_key(key)
+                verify_value(value)
         else:
-            if not isinstance(body, Sequence):
+            # array.array is only registered as a Sequence from python 3.10
+            if not isinstance(body, (Sequence, array)):
                 raise SignatureBodyMismatchError(
                     f'DBus ARRAY type "a" must be Python type "Sequence", e.g. "list", got {type(body)}'
                 )
+            if body and child_type.type_code in INTEGER_RANGES:
+                # Check all the members at once. If that fails, verify each member below, to
+                # get the error.
+                if _integers_in_range(body, *INTEGER_RANGES[child_type.type_code]):
+                    return
+            elif child_type.type_code == "d" and isinstance(body, array) and body.typecode in "fd":
+                return
+            elif child_type._validator is Signature._verify_string:
+                # As for integers, check the types of all the members at once.
+                if all(issubclass(member_type, str) for member_type in set(map(type, body))):
+                    return
+            verify = child_type.verify
             for member in body:
-                child_type.verify(member)
+                verify(member)
 
     def _verify_struct(self, body):
         if not isinstance(body, Sequence):
@@ -320,8 +403,8 @@ class Signature:
                 'DBus STRUCT type "(" must have Python list members equal to the number of struct type members'
             )
 
-        for i, member in enumerate(body):
-            self.children[i].verify(member)
+        for child, member in zip(self.children, body):
+            child.verify(member)
 
     def _verify_variant(self, body):
         # a variant signature and value is valid by construction
@@ -337,27 +420,35 @@ class Signature:
         :raises:
             :class:`SignatureBodyMismatchError` if the body does not match this type.
         """
+        check = self._check
+        if check is None:
+            check = _compile_check(self)
+            object.__setattr__(self, "_check", check)
+        if check(body):
+            return True
+
+        # Walk the body with the validators, to raise the error, or to verify what the
+        # check could not.
         if body is None:
             raise SignatureBodyMismatchError('Cannot serialize Python type "None"')
-        validator = self.validators.get(self.type_code)
-        if validator:
-            validator(self, body)
-        else:
+        validator = self._validator
+        if validator is None:
             raise Exception(f"cannot verify type with token {self.type_code}")
+        validator(self, body)
 
         return True
 
     validators = {
-        "y": _verify_byte,
+        "y": _integer_validator("y"),
         "b": _verify_boolean,
-        "n": _verify_int16,
-        "q": _verify_uint16,
-        "i": _verify_int32,
-        "u": _verify_uint32,
-        "x": _verify_int64,
-        "t": _verify_uint64,
+        "n": _integer_validator("n"),
+        "q": _integer_validator("q"),
+        "i": _integer_validator("i"),
+        "u": _integer_validator("u"),
+        "x": _integer_validator("x"),
+        "t": _integer_validator("t"),
         "d": _verify_double,
-        "h": _verify_uint32,
+        "h": _integer_validator("h"),
         "o": _verify_string,
         "s": _verify_string,
         "g": _verify_signature,
@@ -368,6 +459,146 @@ class Signature:
     }
 
 
+# Basic types are shared by all the signatures that contain them.
+BASIC_TYPES = {type_code: Signature(type_code, type_code, ()) for type_code in BASIC_TYPE_CODES}
+# Seed the caches with the most common signatures.
+_single_type_cache.update(BASIC_TYPES)
+_signature_cache[""] = Signature("", "r", ())
+for type_code, signature in BASIC_TYPES.items():
+    _signature_cache[type_code] = Signature(type_code, "r", (signature,))
+del type_code, signature
+
+
+# Python allows at most 20 nested blocks in a function, so arrays nested deeper than this
+# are checked by a separately compiled check.
+MAX_CHECK_INDENT = 10
+
+
+@lru_cache(maxsize=1024)
+def _compile_check(signature: Signature) -> Callable[[Any], bool]:
+    """Compile a function that checks that a body matches the signature, with the checks of
+    all the types inlined, rather than walking the signature for each value.
+
+    The function returns False rather than raising, and may return False for some bodies
+    that are valid (e.g. signatures given as str), so that ``verify`` walks the body to
+    raise the error, or to verify it.
+    """
+    compiler = _CheckCompiler()
+    compiler.lines.append("def check(value):")
+    compiler.check(signature, "value", 1)
+    compiler.emit(1, "return True")
+    source = "\n".join(compiler.lines)
+    exec(compile(source, f"<check {signature.text!r}>", "exec"), compiler.namespace)
+    return compiler.namespace["check"]
+
+
+class _CheckCompiler:
+    def __init__(self):
+        self.lines: List[str] = []
+        self.var_count = 0
+        self.namespace: Dict[str, Any] = {
+            "Mapping": Mapping,
+            "Sequence": Sequence,
+            "Signature": Signature,
+            "Variant": Variant,
+            "array": array,
+            "integers_in_range": _integers_in_range,
+        }
+
+    def new_var(self) -> str:
+        self.var_count += 1
+        return f"v{self.var_count}"
+
+    def emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+
+    @staticmethod
+    def is_sequence(value: str, types: str = "list, tuple") -> str:
+        # isinstance of an abstract class is slow, so check for the usual types first. Mappings
+        # are checked the same way.
+        return f"(isinstance({value}, ({types})) or isinstance({value}, Sequence))"
+
+    def fail_unless(self, indent: int, condition: str):
+        self.emit(indent, f"if not ({condition}):")
+        self.emit(indent + 1, "return False")
+
+    def check(self, signature: Signature, value: str, indent: int):
+        """Emit the code to check the value held in the variable value."""
+        type_code = signature.type_code
+
+        if type_code == "b":
+            self.fail_unless(indent, f"isinstance({value}, bool)")
+        elif type_code in INTEGER_RANGES:
+            low, high = INTEGER_RANGES[type_code]
+            self.fail_unless(indent, f"isinstance({value}, int) and {low} <= {value} <= {high}")
+        elif type_code == "d":
+            self.fail_unless(indent, f"isinstance({value}, (float, int))")
+        elif type_code in "so":
+            self.fail_unless(indent, f"isinstance({value}, str)")
+        elif type_code == "g":
+            # str signatures are left to the validator, which parses them
+            self.fail_unless(
+                indent, f"isinstance({value}, Signature) and len({value}.text) <= 0xFF"
+            )
+        elif type_code == "v":
+            self.fail_unless(indent, f"isinstance({value}, Variant)")
+        elif type_code in "(r":
+            children = signature.children
+            self.fail_unless(
+                indent, f"{self.is_sequence(value)} and len({value}) == {len(children)}"
+            )
+            if children:
+                values = [self.new_var() for _ in children]
+                self.emit(indent, f"{', '.join(values)}, = {value}")
+                for child, child_value in zip(children, values):
+                    self.check(child, child_value, indent)
+        elif type_code == "a":
+            if indent > MAX_CHECK_INDENT:
+                name = f"check_{self.new_var()}"
+                self.namespace[name] = _compile_check(signature)
+                self.fail_unless(indent, f"{name}({value})")
+            else:
+                self.check_array(signature, value, indent)
+        else:
+            # no validator for the type, so leave verify to raise the error
+            self.emit(indent, "return False")
+
+    def check_array(self, signature: Signature, value: str, indent: int):
+        child = signature.children[0]
+        child_type_code = child.type_code
+        item = self.new_var()
+
+        if child_type_code == "y":
+            self.fail_unless(indent, f"isinstance({value}, (bytearray, bytes))")
+        elif child_type_code == "{":
+            key = self.new_var()
+            self.fail_unless(indent, f"(isinstance({value}, dict) or isinstance({value}, Mapping))")
+            self.emit(indent, f"for {key}, {item} in {value}.items():")
+            self.check(child.children[0], key, indent + 1)
+            self.check(child.children[1], item, indent + 1)
+        else:
+            # array.array is only registered as a Sequence from python 3.10
+            self.fail_unless(indent, self.is_sequence(value, "list, tuple, array"))
+            if child_type_code in INTEGER_RANGES:
+                low, high = INTEGER_RANGES[child_type_code]
+                self.emit(indent, f"if {value} and not integers_in_range({value}, {low}, {high}):")
+                self.emit(indent + 1, "return False")
+            elif child_type_code in "so":
+                self.fail_unless(
+                    indent,
+                    f"all(issubclass(member_type, str) for member_type in set(map(type, {value})))",
+                )
+            else:
+                if child_type_code == "d":
+                    self.emit(
+                        indent,
+                        f'if not isinstance({value}, array) or {value}.typecode not in "fd":',
+                    )
+                    indent += 1
+                self.emit(indent, f"for {item} in {value}:")
+                self.check(child, item, indent + 1)
+
+
 @dataclass
 class Variant:
     """A class to represent a DBus variant (type "v").
@@ -411,18 +642,9 @@ def signature_contains_type(
     if isinstance(signature, str):
         signature = parse_signature(signature)
 
-    queue: List[Signature] = [signature]
-    contains_variants = False
-
-    while queue:
-        decedent = queue.pop()
-        if decedent.type_code == type_code:
-            return True
-        elif decedent.type_code == "v":
-            contains_variants = True
-        queue.extend(decedent.children)
-
-    if not contains_variants:
+    if type_code in signature._type_codes:
+        return True
+    if "v" not in signature._type_codes:
         return False
 
     body_queue = list(body)
@@ -8,10 +8,13 @@ from .errors import (
     InvalidObjectPathError,
 )
 
-_bus_name_re = re.compile(r"^[A-Za-z_-][A-Za-z0-9_-]*$")
-_path_re = re.compile(r"^[A-Za-z0-9_]+$")
-_element_re = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
-_member_re = re.compile(r"^[A-Za-z_][A-Za-z0-9_-]*$")
+# Each of these matches a whole name in one pass, rather than splitting the name into
+# elements and matching each of them. They are used with fullmatch, as "$" would also match
+# before a trailing newline.
+_bus_name_re = re.compile(r"[A-Za-z_-][A-Za-z0-9_-]*(?:\.[A-Za-z_-][A-Za-z0-9_-]*)+")
+_path_re = re.compile(r"/|(?:/[A-Za-z0-9_]+)+")
+_interface_name_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)+")
+_member_re = re.compile(r"[A-Za-z_][A-Za-z0-9_-]*")
 
 
 @lru_cache(maxsize=32)
@@ -36,17 +39,7 @@ def is_bus_name_valid(name: str) -> bool:
         # a unique bus name
         return True
 
-    if name.startswith("."):
-        return False
-
-    if name.find(".") == -1:
-        return False
-
-    for element in name.split("."):
-        if _bus_name_re.search(element) is None:
-            return False
-
-    return True
+    return _bus_name_re.fullmatch(name) is not None
 
 
 @lru_cache(maxsize=1024)
@@ -64,20 +57,7 @@ def is_object_path_valid(path: str) -> bool:
     if not isinstance(path, str):
         return False
 
-    if not path:
-        return False
-
-    if not path.startswith("/"):
-        return False
-
-    if len(path) == 1:
-        return True
-
-    for element in path[1:].split("/"):
-        if _path_re.search(element) is None:
-            return False
-
-    return True
+    return _path_re.fullmatch(path) is not None
 
 
 @lru_cache(maxsize=32)
@@ -98,17 +78,7 @@ def is_interface_name_valid(name: str) -> bool:
     if not name or len(name) > 255:
         return False
 
-    if name.startswith("."):
-        return False
-
-    if name.find(".") == -1:
-        return False
-
-    for element in name.split("."):
-        if _element_re.search(element) is None:
-            return False
-
-    return True
+    return _interface_name_re.fullmatch(name) is not None
 
 
 @lru_cache(maxsize=512)
@@ -129,10 +99,7 @@ def is_member_name_valid(member: str) -> bool:
     if not member or len(member) > 255:
         return False
 
-    if _member_re.search(member) is None:
-        return False
-
-    return True
+    return _member_re.fullmatch(member) is not None
 
 
 def assert_bus_name_valid(name: str):
@@ -1,6 +1,7 @@
 from contextlib import AsyncExitStack
 
 import pytest
+import pytest_asyncio
 
 from dbus_ezy import Message
 from dbus_ezy.aio import MessageBus
@@ -23,103 +24,165 @@ class ExampleInterface(ServiceInterface):
         return ["hello", "world"]
 
 
-@pytest.mark.asyncio
-async def test_signals():
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def bus_pair():
+    """Two buses shared by the tests in this module, as connecting is slow. Tests must
+    remove what they add to them."""
     async with AsyncExitStack() as stack:
-        bus1 = await stack.enter_async_context(MessageBus())
-        bus2 = await stack.enter_async_context(MessageBus())
-
-        bus_intr = await bus1.introspect("org.freedesktop.DBus", "/org/freedesktop/DBus")
-        bus_obj = bus1.get_proxy_object("org.freedesktop.DBus", "/org/freedesktop/DBus", bus_intr)
-        stats = bus_obj.get_interface("org.freedesktop.DBus.Debug.Stats")
+        yield (
+            await stack.enter_async_context(MessageBus()),
+            await stack.enter_async_context(MessageBus()),
+        )
 
-        await bus1.request_name("test.signals.name")
-        service_interface = ExampleInterface()
-        bus1.export("/test/path", service_interface)
 
-        obj = bus2.get_proxy_object(
-            "test.signals.name", "/test/path", bus1._introspect_export_path("/test/path")
+@pytest_asyncio.fixture(loop_scope="module")
+async def signal_service(bus_pair):
+    """Export an ExampleInterface on the first bus as test.signals.name, and yield it with
+    the proxy interface for it on the second bus."""
+    bus1, bus2 = bus_pair
+    await bus1.request_name("test.signals.name")
+    service_interface = ExampleInterface()
+    bus1.export("/test/path", service_interface)
+
+    obj = bus2.get_proxy_object(
+        "test.signals.name", "/test/path", bus1._introspect_export_path("/test/path")
+    )
+    yield service_interface, obj.get_interface(service_interface.name)
+
+    bus1.unexport("/test/path", service_interface)
+    await bus1.release_name("test.signals.name")
+
+
+async def ping(bus_pair):
+    """Call the first bus from the second, so that the bus daemon has handled everything
+    the second bus sent before, and the first bus has received any signals emitted before."""
+    bus1, bus2 = bus_pair
+    await bus2.call(
+        Message(
+            destination=bus1.unique_name,
+            interface="org.freedesktop.DBus.Peer",
+            path="/test/path",
+            member="Ping",
         )
-        interface = obj.get_interface(service_interface.name)
+    )
 
-        async def ping():
-            await bus2.call(
-                Message(
-                    destination=bus1.unique_name,
-                    interface="org.freedesktop.DBus.Peer",
-                    path="/test/path",
-                    member="Ping",
-                )
-            )
 
-        err = None
+async def get_match_rules(bus_pair):
+    """Get the match rules of the second bus."""
+    bus1, bus2 = bus_pair
+    await ping(bus_pair)
+    bus_intr = await bus1.introspect("org.freedesktop.DBus", "/org/freedesktop/DBus")
+    bus_obj = bus1.get_proxy_object("org.freedesktop.DBus", "/org/freedesktop/DBus", bus_intr)
+    stats = bus_obj.get_interface("org.freedesktop.DBus.Debug.Stats")
+    match_rules = await stats.call_get_all_match_rules()
+    assert bus2.unique_name in match_rules
+    return match_rules[bus2.unique_name]
 
-        single_counter = 0
 
-        def single_handler(value):
-            try:
-                nonlocal single_counter
-                nonlocal err
-                assert value == "hello"
-                assert current_message.sender
-                single_counter += 1
-            except Exception as e:
-                err = e
+@pytest.mark.asyncio(loop_scope="module")
+async def test_signal_match_rules(bus_pair, signal_service):
+    """Adding a signal handler with `on_[signal]` should add a match rule and message
+    handler. Removing a signal handler with `off_[signal]` should remove the match rule
+    and message handler to avoid memory leaks."""
+    _, bus2 = bus_pair
+    _, interface = signal_service
+    rule = "type='signal',interface='test.interface',path='/test/path',sender='test.signals.name'"
 
-        multiple_counter = 0
+    # the bus connection itself takes a rule on NameOwnerChange after the high
+    # level client is initialized
+    bus_match_rules = await get_match_rules(bus_pair)
+    assert len(bus_match_rules) == 1
+    assert len(bus2._user_message_handlers) == 0
 
-        def multiple_handler(value1, value2):
-            nonlocal multiple_counter
-            nonlocal err
-            try:
-                assert value1 == "hello"
-                assert value2 == "world"
-                assert current_message.sender
-                multiple_counter += 1
-            except Exception as e:
-                err = e
+    def single_handler(value):
+        pass
 
-        await ping()
-        match_rules = await stats.call_get_all_match_rules()
-        assert bus2.unique_name in match_rules
-        bus_match_rules = match_rules[bus2.unique_name]
-        # the bus connection itself takes a rule on NameOwnerChange after the high
-        # level client is initialized
-        assert len(bus_match_rules) == 1
-        assert len(bus2._user_message_handlers) == 0
-
-        interface.on_some_signal(single_handler)
-        interface.on_signal_multiple(multiple_handler)
-
-        # Interlude: adding a signal handler with `on_[signal]` should add a match rule and
-        # message handler. Removing a signal handler with `off_[signal]` should
-        # remove the match rule and message handler to avoid memory leaks.
-        await ping()
-        match_rules = await stats.call_get_all_match_rules()
-        assert bus2.unique_name in match_rules
-        bus_match_rules = match_rules[bus2.unique_name]
-        # test the match rule and user handler has been added
-        assert len(bus_match_rules) == 2
-        assert (
-            "type='signal',interface='test.interface',path='/test/path',sender='test.signals.name'"
-            in bus_match_rules
-        )
-        assert len(bus2._user_message_handlers) == 1
+    def multiple_handler(value1, value2):
+        pass
 
-        service_interface.SomeSignal()
-        await ping()
-        assert err is None
-        assert single_counter == 1
+    interface.on_some_signal(single_handler)
+    interface.on_signal_multiple(multiple_handler)
 
-        service_interface.SignalMultiple()
-        await ping()
-        assert err is None
-        assert multiple_counter == 1
+    bus_match_rules = await get_match_rules(bus_pair)
+    assert len(bus_match_rules) == 2
+    assert rule in bus_match_rules
+    assert len(bus2._user_message_handlers) == 1
+
+    interface.off_some_signal(single_handler)
+    interface.off_signal_multiple(multiple_handler)
+
+    bus_match_rules = await get_match_rules(bus_pair)
+    assert len(bus_match_rules) == 1
+    assert rule not in bus_match_rules
+    assert len(bus2._user_message_handlers) == 0
+
+
+@pytest.mark.asyncio(loop_scope="module")
+async def test_signals(bus_pair, signal_service):
+    service_interface, interface = signal_service
 
-        # special case: another bus with the same path and interface but on a
-        # different name and connection will trigger the match rule of the first
-        # (happens with mpris)
-        bus3 = await stack.enter_async_context(MessageBus())
+    err = None
+
+    single_counter = 0
+
+    def single_handler(value):
+        try:
+            nonlocal single_counter
+            nonlocal err
+            assert value == "hello"
+            assert current_message.sender
+            single_counter += 1
+        except Exception as e:
+            err = e
+
+    multiple_counter = 0
+
+    def multiple_handler(value1, value2):
+        nonlocal multiple_counter
+        nonlocal err
+        try:
+            assert value1 == "hello"
+            assert value2 == "world"
+            assert current_message.sender
+            multiple_counter += 1
+        except Exception as e:
+            err = e
+
+    interface.on_some_signal(single_handler)
+    interface.on_signal_multiple(multiple_handler)
+    await ping(bus_pair)
+
+    service_interface.SomeSignal()
+    await ping(bus_pair)
+    assert err is None
+    assert single_counter == 1
+
+    service_interface.SignalMultiple()
+    await ping(bus_pair)
+    assert err is None
+    assert multiple_counter == 1
+
+    interface.off_some_signal(single_handler)
+    interface.off_signal_multiple(multiple_handler)
+
+
+@pytest.mark.asyncio(loop_scope="module")
+async def test_signals_from_other_name(bus_pair, signal_service):
+    """Another bus with the same path and interface but on a different name and connection
+    will trigger the match rule of the first (happens with mpris). Make sure its signals
+    only go to its own handlers."""
+    _, bus2 = bus_pair
+    service_interface, interface = signal_service
+
+    counter = 0
+
+    def handler(value):
+        nonlocal counter
+        counter += 1
+
+    interface.on_some_signal(handler)
+
+    async with MessageBus() as bus3:
         await bus3.request_name("test.signals.name2")
         service_interface2 = ExampleInterface()
         bus3.export("/test/path", service_interface2)
@@ -134,36 +197,28 @@ async def test_signals():
             pass
 
         iface2.on_some_signal(dummy_signal_handler)
-        await ping()
+        await ping(bus_pair)
 
         service_interface2.SomeSignal()
-        await ping()
-        # single_counter is not incremented for signals of the second interface
-        assert single_counter == 1
+        await ping(bus_pair)
+        # the handler is not called for signals of the second interface
+        assert counter == 0
+
+        service_interface.SomeSignal()
+        await ping(bus_pair)
+        assert counter == 1
 
-        interface.off_some_signal(single_handler)
-        interface.off_signal_multiple(multiple_handler)
         iface2.off_some_signal(dummy_signal_handler)
 
-        # After `off_[signal]`, the match rule and user handler should be removed
-        await ping()
-        match_rules = await stats.call_get_all_match_rules()
-        assert bus2.unique_name in match_rules
-        bus_match_rules = match_rules[bus2.unique_name]
-        assert len(bus_match_rules) == 1
-        assert (
-            "type='signal',interface='test.interface',path='/test/path',sender='test.signals.name'"
-            not in bus_match_rules
-        )
-        assert len(bus2._user_message_handlers) == 0
+    interface.off_some_signal(handler)
 
 
-@pytest.mark.asyncio
-async def test_signals_with_changing_owners():
+@pytest.mark.asyncio(loop_scope="module")
+async def test_signals_with_changing_owners(bus_pair):
     well_known_name = "test.signals.changing.name"
+    client_bus, _ = bus_pair
 
     async with AsyncExitStack() as stack:
-        client_bus = await stack.enter_async_context(MessageBus())
         # not using context manger - will be disconnect manually.
         service_bus1 = await MessageBus().connect()
         service_bus2 = await stack.enter_async_context(MessageBus())
@@ -224,3 +279,5 @@ async def test_signals_with_changing_owners():
         await ping()
         assert counter == 1
         counter = 0
+
+        iface.off_some_signal(handler)
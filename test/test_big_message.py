@@ -8,6 +8,9 @@ from test.util import check_gi_repository, skip_reason_no_gi
 
 has_gi = check_gi_repository()
 
+# two megabytes, shared by the aio and glib tests
+BIG_BYTES = bytes(2_000_000)
+
 
 class ExampleInterface(ServiceInterface):
     def __init__(self):
@@ -28,8 +31,7 @@ async def test_aio_big_message():
         interface = ExampleInterface()
         bus1.export("/test/path", interface)
 
-        # two megabytes
-        big_body = [bytes(1000000) * 2]
+        big_body = [BIG_BYTES]
         result = await bus2.call(
             Message(
                 destination=bus1.unique_name,
@@ -52,8 +54,7 @@ def test_glib_big_message():
     interface = ExampleInterface()
     bus1.export("/test/path", interface)
 
-    # two megabytes
-    big_body = [bytes(1000000) * 2]
+    big_body = [BIG_BYTES]
     result = bus2.call_sync(
         Message(
             destination=bus1.unique_name,
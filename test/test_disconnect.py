@@ -1,17 +1,26 @@
+import socket
+
 import pytest
+import pytest_asyncio
 
 from dbus_ezy import Message
 from dbus_ezy.aio import MessageBus
 
 
+@pytest_asyncio.fixture
+async def connected_bus():
+    bus = await MessageBus().connect()
+    yield bus
+    # the tests disconnect the bus themselves, unless they failed before that
+    if not bus._disconnected:
+        bus.disconnect()
+
+
 @pytest.mark.asyncio
-async def test_bus_disconnect_before_reply():
+async def test_bus_disconnect_before_reply(connected_bus):
     """In this test, the bus disconnects before the reply comes in. Make sure
     the caller receives a reply with the error instead of hanging."""
-    bus = MessageBus()
-    assert not bus.connected
-    await bus.connect()
-    assert bus.connected
+    bus = connected_bus
 
     ping = bus.call(
         Message(
@@ -32,35 +41,30 @@ async def test_bus_disconnect_before_reply():
     assert (await bus.wait_for_disconnect()) is None
 
 
-# This test doesn't make sense to me
-# We maybe want to create a test where the dbus sever get's killed.
-
-# @pytest.mark.asyncio
-# async def test_unexpected_disconnect():
-#     bus = MessageBus()
-#     assert not bus.connected
-#     await bus.connect()
-#     assert bus.connected
+@pytest.mark.asyncio
+async def test_unexpected_disconnect(connected_bus):
+    """In this test, the connection is closed from under the bus, as if the bus
+    daemon went away. Make sure the caller and wait_for_disconnect get the error."""
+    bus = connected_bus
 
-#     ping = bus.call(
-#         Message(
-#             destination="org.freedesktop.DBus",
-#             path="/org/freedesktop/DBus",
-#             interface="org.freedesktop.DBus",
-#             member="Ping",
-#         )
-#     )
+    ping = bus.call(
+        Message(
+            destination="org.freedesktop.DBus",
+            path="/org/freedesktop/DBus",
+            interface="org.freedesktop.DBus",
+            member="Ping",
+        )
+    )
 
-#     print("before close")
-#     os.close(bus._fd)
-#     print("after close")
+    # Shutting the socket down makes the next read see EOF straight away, without closing
+    # the fd that the bus and its event loop callbacks still use.
+    bus._sock.shutdown(socket.SHUT_RDWR)
 
-#     with pytest.raises(OSError):
-#         await ping
-#     print("after ping wait")
+    with pytest.raises((EOFError, BrokenPipeError)):
+        await ping
 
-#     assert bus._disconnected
-#     assert not bus.connected
+    assert bus._disconnected
+    assert not bus.connected
 
-#     with pytest.raises(OSError):
-#         await bus.wait_for_disconnect()
+    with pytest.raises((EOFError, BrokenPipeError)):
+        await bus.wait_for_disconnect()
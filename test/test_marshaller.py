@@ -1,26 +1,33 @@
 import io
 import json
 import os
+import struct
+from array import array
 from dataclasses import dataclass
 from pprint import pprint
 from socket import socketpair
+from typing import List
 
 import pytest
 
 from dbus_ezy import Message, MessageFlag, MessageType, Signature, Variant
-from dbus_ezy._private.unmarshaller import Unmarshaller
-from dbus_ezy.signature import parse_single_type
+from dbus_ezy._private.constants import BIG_ENDIAN
+from dbus_ezy._private.unmarshaller import Unmarshaller, compile_reader
+from dbus_ezy.signature import parse_signature, parse_single_type
+
+# Maps bytes that are not printable ascii to "."
+PRINTABLE = bytes(x if 32 <= x < 127 else ord(".") for x in range(256))
 
 
 def hexdump(buffer: bytes):
     lines = []
     for i in range(0, len(buffer), 16):
-        line_bytes = bytearray(buffer[i : i + 16])
+        line_bytes = bytes(buffer[i : i + 16])
         line = "{:08x}  {:23}  {:23}  |{:16}|".format(
             i,
-            " ".join(("{:02x}".format(x) for x in line_bytes[:8])),
-            " ".join(("{:02x}".format(x) for x in line_bytes[8:])),
-            "".join((chr(x) if 32 <= x < 127 else "." for x in line_bytes)),
+            line_bytes[:8].hex(" "),
+            line_bytes[8:].hex(" "),
+            line_bytes.translate(PRINTABLE).decode("ascii"),
         )
         lines.append(line)
     return "\n".join(lines)
@@ -50,70 +57,94 @@ class MessageExample:
 
 # variants are an object in the json
 def replace_variants(signature: Signature, item):
-    if signature.type_code == "v" and type(item) is not Variant:
-        item = Variant(
-            item["signature"],
-            replace_variants(parse_single_type(item["signature"]), item["value"]),
-        )
-    elif signature.type_code == "a":
-        for i, item_child in enumerate(item):
-            if signature.children[0].type_code == "{":
-                for k, v in item.items():
-                    item[k] = replace_variants(signature.children[0].children[1], v)
+    root = [item]
+    # The values to replace as (signature, container, key), and the variants to make once
+    # their value has been replaced as (None, container, key).
+    stack = [(signature, root, 0)]
+    while stack:
+        signature, container, key = stack.pop()
+        value = container[key]
+        if signature is None:
+            container[key] = Variant(*value)
+            continue
+        type_code = signature.type_code
+        if type_code == "v":
+            if type(value) is not Variant:
+                variant_signature = parse_single_type(value["signature"])
+                container[key] = [variant_signature, value["value"]]
+                stack.append((None, container, key))
+                stack.append((variant_signature, container[key], 1))
+        elif "v" not in signature.text:
+            # there are no variants to replace in this value
+            pass
+        elif type_code == "a":
+            child = signature.children[0]
+            if child.type_code == "{":
+                stack.extend((child.children[1], value, k) for k in value)
             else:
-                item[i] = replace_variants(signature.children[0], item_child)
-    elif signature.type_code == "(":
-        for i, item_child in enumerate(item):
-            if signature.children[0].type_code == "{":
-                assert False
-            else:
-                item[i] = replace_variants(signature.children[i], item_child)
+                stack.extend((child, value, i) for i in range(len(value)))
+        elif type_code == "(":
+            stack.extend(
+                (child, value, i) for i, child in enumerate(signature.children) if "v" in child.text
+            )
+
+    return root[0]
 
-    return item
+
+def load_messages(path: str) -> List[MessageExample]:
+    with open(path) as f:
+        return [MessageExample.from_json(item) for item in json.load(f)]
 
 
 # these messages have been verified with another library
-messages = [
-    MessageExample.from_json(item)
-    for item in json.load(open(os.path.dirname(__file__) + "/data/messages.json"))
-]
+messages = load_messages(os.path.join(os.path.dirname(__file__), "data", "messages.json"))
 
 
 @pytest.mark.parametrize("item", messages)
 def test_marshall(item: MessageExample):
-    pprint(item.message)
-    print()
-    print("Expected:")
-    print(hexdump(item.data))
-    print()
-
     buf = item.message._marshall()
 
-    print("Marshaled:")
-    print(hexdump(bytes(buf)))
+    # The output is only shown for failed tests, so only format it then.
+    if buf != item.data:
+        pprint(item.message)
+        print()
+        print("Expected:")
+        print(hexdump(item.data))
+        print()
+        print("Marshaled:")
+        print(hexdump(bytes(buf)))
 
     assert buf == item.data
 
 
 @pytest.mark.parametrize("item", messages)
 def test_unmarshall(item: MessageExample):
-    print(hexdump(item.data))
-    print()
-    print("Expected:")
-    pprint(item.message)
-    print()
-
     stream = io.BytesIO(item.data)
     unmarshaller = Unmarshaller(stream)
     message = unmarshaller.unmarshall()
 
-    print("Unmarshalled:")
-    pprint(message)
+    if message != item.message:
+        print(hexdump(item.data))
+        print()
+        print("Expected:")
+        pprint(item.message)
+        print()
+        print("Unmarshalled:")
+        pprint(message)
 
     assert message == item.message
 
 
-def test_unmarshall_can_resume():
+def test_unmarshall_stream():
+    """Verify one unmarshaller can read many messages, as the message buses do."""
+    stream = io.BytesIO(b"".join(item.data for item in messages))
+    unmarshaller = Unmarshaller(stream)
+    for item in messages:
+        assert unmarshaller.unmarshall() == item.message
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 7, 64])
+def test_unmarshall_can_resume(chunk_size: int):
     """Verify resume works."""
     bluez_rssi_message = bytes.fromhex(
         "6c04010134000000e25389019500000001016f00250000002f6f72672f626c75657a2f686369302f6465"
@@ -123,7 +154,9 @@ def test_unmarshall_can_resume():
         "110000006f72672e626c75657a2e446576696365310000000e0000000000000004000000525353490001"
         "6e00a7ff000000000000"
     )
-    chunks = [bluez_rssi_message[i : i + 4] for i in range(0, len(bluez_rssi_message), 4)]
+    # slices of a memoryview share the message's buffer, rather than each being a copy
+    view = memoryview(bluez_rssi_message)
+    chunks = [view[i : i + chunk_size] for i in range(0, len(view), chunk_size)]
 
     send_sock, recv_sock = socketpair()
     recv_sock.settimeout(0)
@@ -144,3 +177,84 @@ def test_ay_buffer():
     marshalled = msg._marshall()
     unmarshalled_msg = Unmarshaller(io.BytesIO(marshalled)).unmarshall()
     assert unmarshalled_msg.body[0] == body[0]
+
+
+def test_fixed_size_arrays():
+    body = [
+        [True, False],
+        [1, -2],
+        [3],
+        [-5, 6],
+        [7],
+        [1.5, 2.0],
+        [2**63 - 1],
+        [2**64 - 1],
+        [1],
+        [],
+    ]
+    msg = Message(path="/test", member="test", signature="abanaqaiauadaxatahax", body=body)
+    marshalled = msg._marshall()
+    unmarshalled_msg = Unmarshaller(io.BytesIO(marshalled)).unmarshall()
+    assert unmarshalled_msg.body == body
+
+
+def test_fixed_size_arrays_big_endian():
+    # We only marshall little endian messages, so build the body by hand.
+    data = struct.pack(">IiiId", 8, 1, -2, 8, 1.5)
+    body, offset = compile_reader(parse_signature("aiad"), BIG_ENDIAN)(memoryview(data), 0)
+    assert body == [[1, -2], [1.5]]
+    assert offset == len(data)
+
+
+def test_typed_arrays():
+    body = [array("i", [1, -2]), array("d", [1.5])]
+    msg = Message(path="/test", member="test", signature="aiad", body=body)
+    marshalled = msg._marshall()
+    unmarshalled_msg = Unmarshaller(io.BytesIO(marshalled)).unmarshall()
+    assert unmarshalled_msg.body == [[1, -2], [1.5]]
+
+
+def test_padding():
+    # The padding is worked out when the writer is compiled where the offset is known, and
+    # when writing where it depends on the values before it.
+    body = [
+        1,
+        True,
+        [(2, 3.5), (4, 5.5)],
+        "abc",
+        {"d": ("ef", [6.5])},
+        Variant("(yt)", [7, 8]),
+        parse_signature("ay"),
+        b"",
+    ]
+    msg = Message(path="/test", member="test", signature="yba(id)sa{s(sad)}vgay", body=body)
+    marshalled = msg._marshall()
+    unmarshalled_msg = Unmarshaller(io.BytesIO(marshalled)).unmarshall()
+    assert unmarshalled_msg.body == [
+        1,
+        True,
+        [[2, 3.5], [4, 5.5]],
+        "abc",
+        {"d": ["ef", [6.5]]},
+        Variant("(yt)", [7, 8]),
+        "ay",
+        b"",
+    ]
+
+
+def test_int_flags():
+    msg = Message(path="/test", member="test", flags=MessageFlag.NO_REPLY_EXPECTED.value)
+    assert msg.flags is MessageFlag.NO_REPLY_EXPECTED
+
+
+def test_deeply_nested_arrays():
+    # The maximum depth of nested arrays is more than the nested blocks python allows in
+    # a compiled writer or reader.
+    body = {"a": 1.5}
+    for _ in range(31):
+        body = [body]
+    signature = "y" + "a" * 31 + "a{sd}s"
+    msg = Message(path="/test", member="test", signature=signature, body=[1, body, "b"])
+    marshalled = msg._marshall()
+    unmarshalled_msg = Unmarshaller(io.BytesIO(marshalled)).unmarshall()
+    assert unmarshalled_msg.body == [1, body, "b"]
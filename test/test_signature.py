@@ -1,3 +1,4 @@
+from array import array
 from pprint import pprint
 
 import pytest
@@ -94,7 +95,9 @@ def param(text, expected, id=None):
 )
 def test_parse_signature(text: str, expected: Signature):
     signature = parse_signature(text)
-    pprint(signature)
+    # The output is only shown for failed tests, so only format it then.
+    if signature != expected:
+        pprint(signature)
     assert signature == expected
 
 
@@ -219,20 +222,40 @@ def test_parse_signature(text: str, expected: Signature):
 )
 def test_parse_single_type(text: str, expected: Signature):
     signature = parse_single_type(text)
-    pprint(signature)
+    # The output is only shown for failed tests, so only format it then.
+    if signature != expected:
+        pprint(signature)
     assert signature == expected
 
 
+def test_parse_cached(monkeypatch):
+    assert parse_signature("a{sv}") is parse_signature("a{sv}")
+    assert parse_single_type("a{sv}") is parse_single_type("a{sv}")
+
+    # the caches are bounded, as they are keyed on signatures from peers
+    monkeypatch.setattr("dbus_ezy.signature.MAX_CACHED_SIGNATURES", 1)
+    first = parse_signature("a(ss)")
+    parse_signature("a(uu)")
+    assert parse_signature("a(ss)") is not first
+    assert parse_signature("a(ss)") == first
+
+
+def test_parse_shares_types():
+    signature = parse_signature("a{sv}(sa{sv})")
+    dict_type = parse_single_type("a{sv}")
+    assert signature.children[0] is dict_type
+    assert signature.children[1].children[1] is dict_type
+    assert dict_type.children[0].children[0] is parse_single_type("s")
+
+
 def test_contains_type_fd():
     signature = parse_signature("h")
-    pprint(signature)
     assert signature_contains_type(signature, [0], "h")
     assert not signature_contains_type(signature, [0], "u")
 
 
 def test_contains_type_array_fd():
     signature = parse_signature("ah")
-    pprint(signature)
     assert signature_contains_type(signature, [[0]], "h")
     assert signature_contains_type(signature, [[0]], "a")
     assert not signature_contains_type(signature, [[0]], "u")
@@ -240,7 +263,6 @@ def test_contains_type_array_fd():
 
 def test_contains_type_array_var():
     signature = parse_signature("av")
-    pprint(signature)
     body = [[Variant("u", 0), Variant("i", 0), Variant("x", 0), Variant("v", Variant("s", "hi"))]]
     assert signature_contains_type(signature, body, "u")
     assert signature_contains_type(signature, body, "x")
@@ -251,7 +273,6 @@ def test_contains_type_array_var():
 
 def test_contains_type_dict_str_var():
     signature = parse_signature("a{sv}")
-    pprint(signature)
     body = {
         "foo": Variant("h", 0),
         "bar": Variant("i", 0),
@@ -265,7 +286,6 @@ def test_contains_type_dict_str_var():
 
 def test_invalid_variants():
     signature = parse_signature("a{sa{sv}}")
-    pprint(signature)
     s_con = {
         "type": "802-11-wireless",
         "uuid": "1234",
@@ -297,3 +317,71 @@ def test_invalid_variants():
 
     with pytest.raises(SignatureBodyMismatchError):
         signature.verify([con])
+
+
+@pytest.mark.parametrize(
+    "text,body",
+    [
+        param("ai", [[1, 2**31]]),
+        param("au", [[-1, 1]]),
+        param("an", [[1, "2"]]),
+        param("at", [[1, None]]),
+    ],
+)
+def test_invalid_integer_arrays(text, body):
+    with pytest.raises(SignatureBodyMismatchError):
+        parse_signature(text).verify(body)
+
+
+def test_integer_arrays():
+    assert parse_signature("aiahat").verify([[-(2**31), 2**31 - 1], [True, 3], [2**64 - 1]])
+
+
+def test_typed_arrays():
+    assert parse_signature("aiaxad").verify(
+        [array("h", [1, -1]), array("q", [1]), array("f", [1.5])]
+    )
+    # the range of an "I" array is too big for an INT32, so its members are checked
+    assert parse_signature("ai").verify([array("I", [1])])
+    with pytest.raises(SignatureBodyMismatchError):
+        parse_signature("ai").verify([array("I", [2**31])])
+
+
+def test_signature_eq():
+    assert parse_signature("a{sv}") == parse_signature("a{sv}")
+    assert parse_signature("a{sv}") == "a{sv}"
+    assert parse_signature("as") != parse_signature("ai")
+    # the same text parsed as a body signature and as a single type are different types
+    assert parse_signature("s") != parse_single_type("s")
+
+
+def test_verify_equal_bodies_of_different_types():
+    # Equal bodies don't necessarily match the same signatures, so verify results can't be
+    # looked up by body.
+    assert (True,) == (1,)
+    assert parse_signature("b").verify((True,))
+    with pytest.raises(SignatureBodyMismatchError):
+        parse_signature("b").verify((1,))
+    assert parse_signature("i").verify((1,))
+    with pytest.raises(SignatureBodyMismatchError):
+        parse_signature("i").verify((1.0,))
+
+
+def test_string_arrays():
+    assert parse_signature("asao").verify([["a", "b"], ["/a", "/b"]])
+    with pytest.raises(SignatureBodyMismatchError):
+        parse_signature("as").verify([["a", 1]])
+    with pytest.raises(SignatureBodyMismatchError):
+        parse_signature("as").verify([["a", None]])
+
+
+def test_verify_deeply_nested_arrays():
+    signature = parse_signature("a" * 32 + "(sd)")
+    struct = ["a", 1.5]
+    body = struct
+    for _ in range(32):
+        body = [body]
+    assert signature.verify([body])
+    struct[1] = "b"
+    with pytest.raises(SignatureBodyMismatchError, match='DBus DOUBLE type "d"'):
+        signature.verify([body])
@@ -29,7 +29,7 @@ async def test_tcp_connection_with_forwarding():
         async def handle_read():
             try:
                 while True:
-                    data = await tcp_reader.read(1024)
+                    data = await tcp_reader.read(65536)
                     if not data:
                         break
                     unix_writer.write(data)
@@ -39,7 +39,7 @@ async def test_tcp_connection_with_forwarding():
         async def handle_write():
             try:
                 while True:
-                    data = await unix_reader.read(1024)
+                    data = await unix_reader.read(65536)
                     if not data:
                         print("unix_reader closed")
                         break
@@ -17,6 +17,7 @@ def test_object_path_validator():
         "/$/foo/bar",
         "/foo//bar",
         "/foo$bar/baz",
+        "/foo\n",
     ]
 
     for path in valid_paths:
@@ -43,6 +44,7 @@ def test_bus_name_validator():
         "bar..baz",
         "$foo.bar",
         "foo$.ba$r",
+        "foo.bar\n",
     ]
 
     for name in valid_names:
@@ -63,6 +65,7 @@ def test_interface_name_validator():
         "$foo.bar",
         "foo$.ba$r",
         "org.mpris.MediaPlayer2.google-play-desktop-player",
+        "foo.bar\n",
     ]
 
     for name in valid_names:
@@ -73,7 +76,7 @@ def test_interface_name_validator():
 
 def test_member_name_validator():
     valid_members = ["foo", "FooBar", "Bat_Baz69", "foo-bar"]
-    invalid_members = [None, "", "foo.bar", "5foo", "foo$bar"]
+    invalid_members = [None, "", "foo.bar", "5foo", "foo$bar", "foo\n"]
 
     for member in valid_members:
         assert is_member_name_valid(member), f'member name should be valid: "{member}"'